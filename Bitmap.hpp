@@ -4,7 +4,7 @@
 #include <cstdint>
 #include <array>
 
-template <uint16_t pixel_data_size>
+template <uint16_t pixel_data_size, uint8_t row_index_size = 0>
 struct Bitmap {
   //* ════════════════════════════════════════════════════════════════════════════════════════════════════
   uint8_t width;
@@ -14,6 +14,84 @@ struct Bitmap {
   uint8_t transparent_pixel_designator;
   bool compressed;
   std::array<uint8_t, pixel_data_size> pixel_data;
+  uint8_t rows_per_tile;                           // 0 if the pixel data has no row index, otherwise runs never cross a tile of this many rows
+  std::array<uint16_t, row_index_size> row_index;  // The index in pixel_data that each tile of rows starts at
+  bool extended;                                   // If the compressed pixel data uses the extended format with literal spans and runs longer than 15 pixels
+};
+
+/**
+ * @brief Lets the decompression methods read pixel data that is stored inside of a @ref BitmapAtlas "BitmapAtlas" the same way as a std::array
+ */
+struct BitmapAtlasData {
+  const uint8_t* data;
+  uint8_t at(uint16_t index) const { return data[index]; }
+};
+
+/**
+ * @brief A bitmap from a @ref BitmapAtlas "BitmapAtlas", it has the same members as a @ref Bitmap "Bitmap" so it can be passed to any of the decompression methods
+ */
+struct AtlasBitmap {
+  uint8_t width;
+  uint8_t height;
+  uint16_t size;
+  bool transparency;
+  uint8_t transparent_pixel_designator;
+  bool compressed;
+  BitmapAtlasData pixel_data;
+  uint8_t rows_per_tile;
+  std::array<uint16_t, 0> row_index;
+  bool extended;
+  bool delta;  // If the pixel data only holds the changes from the previous frame of an animation, these are drawn with DecompressDelta
+};
+
+/**
+ * @brief Where one bitmap's data is stored in a @ref BitmapAtlas "BitmapAtlas"
+ */
+struct BitmapAtlasEntry {
+  uint32_t offset;  // The index in the atlas's pixel_data that this bitmap's data starts at, bitmaps with identical data share the same offset
+  uint16_t size;    // Number of bytes of pixel data
+  uint8_t width;
+  uint8_t height;
+  uint8_t flags;  // A combination of BITMAP_ATLAS_COMPRESSED, BITMAP_ATLAS_EXTENDED and BITMAP_ATLAS_DELTA
+};
+
+constexpr uint8_t BITMAP_ATLAS_COMPRESSED = 0b001;
+constexpr uint8_t BITMAP_ATLAS_EXTENDED = 0b010;
+constexpr uint8_t BITMAP_ATLAS_DELTA = 0b100;  // The entry is a frame of an animation that only holds the changes from the frame before it
+
+/**
+ * @brief Many bitmaps packed into one array of pixel data, with a table of where each one is stored. Animations are stored the same way with an entry for each frame
+ * @tparam pixel_data_size The total number of bytes of pixel data for all the bitmaps
+ * @tparam entry_count The number of bitmaps in the atlas
+ */
+template <uint32_t pixel_data_size, uint16_t entry_count>
+struct BitmapAtlas {
+  //* ════════════════════════════════════════════════════════════════════════════════════════════════════
+  bool transparency;
+  uint8_t transparent_pixel_designator;
+  std::array<BitmapAtlasEntry, entry_count> entries;
+  std::array<uint8_t, pixel_data_size> pixel_data;
+
+  /**
+   * @brief Gets one of the bitmaps in the atlas, eg Decompress(x, y, atlas.bitmap(ATLAS_NAME_ICON))
+   * @param index The index of the bitmap in entries, the generated header has a constant for each one
+   */
+  AtlasBitmap bitmap(uint16_t index) const {
+    const BitmapAtlasEntry& entry = entries.at(index);
+    return AtlasBitmap{
+        .width = entry.width,
+        .height = entry.height,
+        .size = entry.size,
+        .transparency = transparency,
+        .transparent_pixel_designator = transparent_pixel_designator,
+        .compressed = (entry.flags & BITMAP_ATLAS_COMPRESSED) != 0,
+        .pixel_data = {pixel_data.data() + entry.offset},
+        .rows_per_tile = 0,
+        .row_index = {},
+        .extended = (entry.flags & BITMAP_ATLAS_EXTENDED) != 0,
+        .delta = (entry.flags & BITMAP_ATLAS_DELTA) != 0,
+    };
+  }
 };
 
 #endif  // BITMAP_HPP
\ No newline at end of file
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+
+import numpy
+
+_CACHE_VERSION = 3  # Bump this whenever the generated header format changes so old entries are never reused
+
+
+# Content hash of everything that ends up in a generated header: the pixels, the image size, the header name and the conversion and layout settings
+def cache_key(pixel_data, image_width, image_height, file_name, transparency, transparent_pixel_designator, compress, bytes_per_line = 10, rows_per_tile = 0):
+    hasher = hashlib.sha256()
+    settings = [_CACHE_VERSION, int(image_width), int(image_height), file_name, bool(transparency), int(transparent_pixel_designator), str(compress), int(bytes_per_line), int(rows_per_tile)]
+    hasher.update(json.dumps(settings).encode("utf-8"))
+    hasher.update(numpy.ascontiguousarray(pixel_data, dtype = numpy.uint8).tobytes())  # Hash the values as bytes so the array's dtype does not change the key
+    return hasher.hexdigest()
+
+
+# Reads a single entry straight from the cache directory without touching the index, this is safe to call from worker processes
+def load_entry(directory, key):
+    try:
+        with open(os.path.join(directory, key + ".json"), "r") as entry_file:
+            return json.load(entry_file)
+    except (OSError, ValueError):  # Missing or corrupt entries are just treated as a miss
+        return None
+
+
+class BuildCache:
+    _INDEX_FILE_NAME = "index.json"
+    _ENTRY_FILE_NAME = re.compile(r"[0-9a-f]{64}\.json")  # An entry is named after its sha256 key, anything else in the directory was put there by something else
+
+    def __init__(self, directory, max_bytes = 64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes  # Once the stored entries add up to more than this, the least recently used ones are removed
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> size in bytes, ordered from least to most recently used
+        os.makedirs(directory, exist_ok = True)
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, self._INDEX_FILE_NAME), "r") as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):  # No index yet (or it is unreadable), so start with an empty cache
+            return
+        if not isinstance(index, dict):  # Valid JSON, but not an index this cache wrote, so it is treated the same as an unreadable one
+            return
+        if index.get("version") != _CACHE_VERSION:  # The entries were made by a different version of the header format, so remove them instead of leaving them around forever
+            for file_name in os.listdir(self.directory):
+                if self._ENTRY_FILE_NAME.fullmatch(file_name):  # Only cache entries are removed, the directory might be shared with other files
+                    os.remove(os.path.join(self.directory, file_name))
+            return
+        for key, size in index.get("entries", []):
+            if os.path.exists(os.path.join(self.directory, key + ".json")):
+                self._entries[key] = size
+
+    def save(self):
+        index = {"version": _CACHE_VERSION, "entries": list(self._entries.items())}
+        temporary_path = os.path.join(self.directory, self._INDEX_FILE_NAME + ".tmp")
+        with open(temporary_path, "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(temporary_path, os.path.join(self.directory, self._INDEX_FILE_NAME))  # Replace in one step so an interrupted build never leaves a half written index
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = load_entry(self.directory, key) if key in self._entries else None
+        self.record(key, hit = entry is not None)
+        return entry
+
+    def put(self, key, entry):
+        contents = json.dumps(entry)
+        with open(os.path.join(self.directory, key + ".json"), "w") as entry_file:
+            entry_file.write(contents)
+        self._entries[key] = len(contents)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    # Updates the statistics and the least recently used order for a lookup that was done elsewhere (eg in a worker process using load_entry)
+    def record(self, key, hit):
+        if hit:
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        else:
+            self.misses += 1
+            self._entries.pop(key, None)  # If the entry file was missing or corrupt, forget about it so it gets replaced
+
+    def _evict(self):
+        stored_bytes = sum(self._entries.values())
+        while stored_bytes > self.max_bytes and len(self._entries) > 1:  # Always keep the entry that was just added, even if it is larger than the limit by itself
+            key, size = self._entries.popitem(last = False)
+            stored_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, key + ".json"))
+            except OSError:
+                pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "stored_bytes": sum(self._entries.values()),
+        }
@@ -1,3 +1,83 @@
+/**
+ * @brief Draws a bitmap compressed with the extended format to the @ref pixel_buffer "pixel buffer". This is called by the other decompression methods when bitmap.extended is set.
+ * The extended format is the same as the normal compressed format except that a byte with a run length of 0 is an escape, and the byte after it is either:
+ * 0LLLLLLL followed by LLLLLLLL, a run of the escape byte's grayscale value that is 16 + the 15 bit length pixels long, or
+ * 1LLLLLLL, a literal span of L + 1 pixels packed two per byte (ggggGGGG) in the bytes that follow
+ * @tparam bitmap_instance The @ref Bitmap "Bitmap" struct instance which holds all bitmap data
+ * @param x The x coordinate which the top left of the bitmap will start to be drawn from
+ * @param y The y coordinate which the top left of the bitmap will start to be drawn from
+ * @param bitmap The bitmap struct instance which contains all the data for an image
+ * @param first_row The first row of the bitmap to draw, rows above it are decoded but not drawn
+ * @param row_count The number of rows to draw
+ */
+template <typename bitmap_instance>
+void DecompressExtended(uint8_t x, uint8_t y, bitmap_instance bitmap, uint8_t first_row = 0, uint8_t row_count = 255) {
+    uint16_t last_row = first_row + row_count;  // One past the last row that will be drawn
+    if (last_row > bitmap.height) last_row = bitmap.height;
+
+    uint16_t input_array_index = 0;  // Holds the index of the array that contains all compressed pixel data for the bitmap
+    uint8_t column = 0;
+    uint16_t row = 0;
+
+    // Draws a single pixel (unless it is transparent or outside of the rows being drawn) and moves to the next one
+    auto next_pixel = [&](uint8_t grayscale) {
+        if ((row >= first_row) && (row < last_row) && !(bitmap.transparency && (grayscale == bitmap.transparent_pixel_designator))) Pixel(x + column, y + row, grayscale);
+        if (++column == bitmap.width) {  // If we have reached the last column of a bitmap, go to the start of the next row
+            column = 0;
+            ++row;
+        }
+    };
+
+    while ((input_array_index < bitmap.size) && (row < last_row)) {
+        uint8_t grayscale = bitmap.pixel_data.at(input_array_index) >> 4;
+        uint16_t sequential_pixels = bitmap.pixel_data.at(input_array_index) & 0b1111;
+        ++input_array_index;
+        if (sequential_pixels == 0) {  // An escape, the next byte says whether it is a long run or a literal span
+            uint8_t escape = bitmap.pixel_data.at(input_array_index);
+            ++input_array_index;
+            if (escape & 0b10000000) {  // A literal span, each following byte holds two pixels
+                uint8_t literal_pixels = (escape & 0b1111111) + 1;
+                for (uint8_t pixel = 0; pixel < literal_pixels; ++pixel) {
+                    uint8_t pixel_pair = bitmap.pixel_data.at(input_array_index + (pixel >> 1));
+                    next_pixel((pixel & 0b1) ? (pixel_pair & 0b1111) : (pixel_pair >> 4));  // Even pixels are in the upper 4 bits, odd pixels are in the lower 4 bits
+                }
+                input_array_index += (literal_pixels + 1) >> 1;
+                continue;
+            }
+            sequential_pixels = ((escape << 8) | bitmap.pixel_data.at(input_array_index)) + 16;  // A long run, the length is stored in 15 bits after the escape
+            ++input_array_index;
+        }
+        for (; (sequential_pixels > 0) && (row < last_row); --sequential_pixels) next_pixel(grayscale);
+    }
+}
+
+/**
+ * @brief Draws a bitmap that is not compressed to the @ref pixel_buffer "pixel buffer". This is called by the other decompression methods when bitmap.compressed is not set.
+ * Each row is stored as (width + 1) / 2 bytes of pixel pairs (ggggGGGG), so the last byte of every row of an odd width bitmap only holds one pixel. As every row is the same size,
+ * drawing starts straight at first_row without reading the rows above it
+ * @tparam bitmap_instance The @ref Bitmap "Bitmap" struct instance which holds all bitmap data
+ * @param x The x coordinate which the top left of the bitmap will start to be drawn from
+ * @param y The y coordinate which the top left of the bitmap will start to be drawn from
+ * @param bitmap The bitmap struct instance which contains all the data for an image
+ * @param first_row The first row of the bitmap to draw
+ * @param row_count The number of rows to draw
+ */
+template <typename bitmap_instance>
+void DecompressUncompressed(uint8_t x, uint8_t y, bitmap_instance bitmap, uint8_t first_row = 0, uint8_t row_count = 255) {
+    uint16_t last_row = first_row + row_count;  // One past the last row that will be drawn
+    if (last_row > bitmap.height) last_row = bitmap.height;
+    uint16_t bytes_per_row = (bitmap.width + 1) >> 1;
+
+    for (uint16_t row = first_row; row < last_row; ++row) {
+        uint16_t input_array_index = row * bytes_per_row;  // Holds the index of the first pixel pair of the row
+        for (uint8_t column = 0; column < bitmap.width; ++column) {
+            uint8_t pixel_pair = bitmap.pixel_data.at(input_array_index + (column >> 1));
+            uint8_t grayscale = (column & 0b1) ? (pixel_pair & 0b1111) : (pixel_pair >> 4);  // Even pixels are in the upper 4 bits, odd pixels are in the lower 4 bits
+            if (!(bitmap.transparency && (grayscale == bitmap.transparent_pixel_designator))) Pixel(x + column, y + row, grayscale);
+        }
+    }
+}
+
 /**
  * @brief Draws a 128 x 128 compressed bitmap to the @ref pixel_buffer "pixel buffer". This is only used for full screen bitmaps as it 
  * does not have bound checking and takes in no start coordinates. It is ~3 times faster than the other decompression for full screen bitmaps.
@@ -6,6 +86,14 @@
  */
 template <typename bitmap_instance>
 void Decompress(bitmap_instance bitmap) {
+    if (!bitmap.compressed) {
+        DecompressUncompressed(0, 0, bitmap);
+        return;
+    }
+    if (bitmap.extended) {
+        DecompressExtended(0, 0, bitmap);
+        return;
+    }
     uint_fast16_t output_array_index = 0;
     uint_fast8_t odd = 0;
     uint_fast16_t input_array_index = 0;
@@ -38,6 +126,14 @@ void Decompress(bitmap_instance bitmap) {
  */
 template <typename bitmap_instance>
 void Decompress(uint8_t x, uint8_t y, bitmap_instance bitmap) {
+    if (!bitmap.compressed) {
+        DecompressUncompressed(x, y, bitmap);
+        return;
+    }
+    if (bitmap.extended) {
+        DecompressExtended(x, y, bitmap);
+        return;
+    }
     if (bitmap.transparency) {
         uint16_t input_array_index = 0;  // Holds the index of the array that contains all compressed pixel data for the bitmap
         uint8_t transparent_pixel_designator = bitmap.transparent_pixel_designator;
@@ -78,6 +174,109 @@ void Decompress(uint8_t x, uint8_t y, bitmap_instance bitmap) {
     }
 }
 
+/**
+ * @brief Draws only some of the rows of a compressed bitmap to the @ref pixel_buffer "pixel buffer", for example the part of a scrolling bitmap that is on screen.
+ * If the bitmap has a row index (rows_per_tile is not 0), decoding starts at the first byte of the tile that holds first_row instead of the first byte of the bitmap.
+ * @tparam bitmap_instance The @ref Bitmap "Bitmap" struct instance which holds all bitmap data
+ * @param x The x coordinate which the top left of the whole bitmap would be drawn from
+ * @param y The y coordinate which the top left of the whole bitmap would be drawn from
+ * @param bitmap The bitmap struct instance which contains all the data for an image
+ * @param first_row The first row of the bitmap to draw, rows above it are not drawn
+ * @param row_count The number of rows to draw
+ */
+template <typename bitmap_instance>
+void Decompress(uint8_t x, uint8_t y, bitmap_instance bitmap, uint8_t first_row, uint8_t row_count) {
+    if (!bitmap.compressed) {  // Every row of uncompressed data is the same size, so it never needs a row index
+        DecompressUncompressed(x, y, bitmap, first_row, row_count);
+        return;
+    }
+    if (bitmap.extended) {  // The extended format has no row index, so it is always decoded from the first byte
+        DecompressExtended(x, y, bitmap, first_row, row_count);
+        return;
+    }
+    uint16_t last_row = first_row + row_count;  // One past the last row that will be drawn
+    if (last_row > bitmap.height) last_row = bitmap.height;
+    if (first_row >= last_row) return;
+
+    uint16_t input_array_index = 0;  // Holds the index of the array that contains all compressed pixel data for the bitmap
+    uint16_t row = 0;                // The row of the bitmap the next pixel belongs to
+    if (bitmap.rows_per_tile) {      // Runs never cross a tile, so decoding can start at the first byte of the tile that first_row is in
+        uint8_t tile = first_row / bitmap.rows_per_tile;
+        input_array_index = bitmap.row_index.at(tile);
+        row = tile * bitmap.rows_per_tile;
+    }
+
+    uint8_t column = 0;
+    while (row < last_row) {
+        uint8_t grayscale = bitmap.pixel_data.at(input_array_index) >> 4;
+        uint8_t sequential_pixels = bitmap.pixel_data.at(input_array_index) & 0b1111;  // Extracts the number of pixels in a compressed byte
+        ++input_array_index;
+        for (; sequential_pixels > 0; --sequential_pixels) {
+            // Rows of the tile above first_row still have to be decoded to find where first_row starts, but they are not drawn
+            if ((row >= first_row) && !(bitmap.transparency && (grayscale == bitmap.transparent_pixel_designator))) Pixel(x + column, y + row, grayscale);
+            if (++column == bitmap.width) {  // If we have reached the last column of a bitmap, go to the start of the next row
+                column = 0;
+                if (++row == last_row) break;
+            }
+        }
+    }
+}
+
+/**
+ * @brief Draws a delta frame of an animation to the @ref pixel_buffer "pixel buffer", only the pixels that changed since the previous frame are written.
+ * The data is the same as the normal compressed format except that a byte with a run length of 0 is a skip, gggg0000 followed by LLLLLLLL leaves the next ggggLLLLLLLL + 1 pixels as they are.
+ * Drawing stops at the end of the data, so any unchanged pixels at the end of the frame take no time at all
+ * @tparam bitmap_instance The @ref AtlasBitmap "AtlasBitmap" of the frame, from the animation's bitmap method
+ * @param x The x coordinate which the top left of the frame will start to be drawn from
+ * @param y The y coordinate which the top left of the frame will start to be drawn from
+ * @param bitmap The frame to draw, the frame before it must already be drawn at the same coordinates
+ */
+template <typename bitmap_instance>
+void DecompressDelta(uint8_t x, uint8_t y, bitmap_instance bitmap) {
+    uint16_t input_array_index = 0;  // Holds the index of the array that contains all compressed pixel data for the frame
+    uint8_t column = 0;
+    uint16_t row = 0;
+
+    while (input_array_index < bitmap.size) {
+        uint8_t grayscale = bitmap.pixel_data.at(input_array_index) >> 4;
+        uint8_t sequential_pixels = bitmap.pixel_data.at(input_array_index) & 0b1111;
+        ++input_array_index;
+        if (sequential_pixels == 0) {  // A skip, jump straight past the unchanged pixels without touching them
+            uint16_t position = column + ((grayscale << 8) | bitmap.pixel_data.at(input_array_index)) + 1;
+            ++input_array_index;
+            row += position / bitmap.width;
+            column = position % bitmap.width;
+            continue;
+        }
+        for (; sequential_pixels > 0; --sequential_pixels) {
+            if (!(bitmap.transparency && (grayscale == bitmap.transparent_pixel_designator))) Pixel(x + column, y + row, grayscale);
+            if (++column == bitmap.width) {  // If we have reached the last column of a bitmap, go to the start of the next row
+                column = 0;
+                ++row;
+            }
+        }
+    }
+}
+
+/**
+ * @brief Draws one frame of an animation made by RLE4Bit.convert_animation (or batch.py --animation). Keyframes are drawn in full and delta frames only change the pixels that
+ * differ from the frame before them, so frames must be drawn in order from a keyframe, frame 0 always is one
+ * @tparam animation_instance The @ref BitmapAtlas "BitmapAtlas" holding the animation
+ * @param x The x coordinate which the top left of the frame will start to be drawn from
+ * @param y The y coordinate which the top left of the frame will start to be drawn from
+ * @param animation The animation, which has an entry for each frame
+ * @param frame The number of the frame to draw, from 0 to animation.entries.size() - 1
+ */
+template <typename animation_instance>
+void DecompressFrame(uint8_t x, uint8_t y, const animation_instance& animation, uint16_t frame) {
+    auto bitmap = animation.bitmap(frame);  // An AtlasBitmap
+    if (bitmap.delta) {
+        DecompressDelta(x, y, bitmap);
+        return;
+    }
+    Decompress(x, y, bitmap);
+}
+
 /**
  * @brief Draws a pixel into the pixel buffer THIS SHOULD BE CHANGED TO MATCH YOUR SETUP
  * @param x The x coordinate of the pixel
@@ -0,0 +1,90 @@
+import cProfile
+import contextlib
+import json
+import os
+import time
+
+import numpy
+
+PROFILE_ENVIRONMENT_VARIABLE = "RLE4BIT_PROFILE"  # Set this to a directory to profile every conversion without changing any code
+trace_hook = None  # If set, called with (stats, stage, seconds) as each stage finishes, eg to forward the timings to a tracing system
+_profiling = False  # Set while a profile is running, only one profiler can be active at a time and the outer one already records everything inside it
+
+
+# Everything measured while converting one image: how long each stage took, how many bytes each part of the output is, and how long the runs of same 'color' pixels are.
+# The stages are load, pack (uncompressed), rle (any compressed format, including working out which is smallest), cache, header and write.
+# An atlas or animation is measured as a whole, with the details of each bitmap or frame in it kept in entries
+class ConversionStats:
+    def __init__(self, source = None, output = None):
+        self.source = source
+        self.output = output
+        self.data_format = None
+        self.image_width = 0
+        self.image_height = 0
+        self.seconds = {}  # Stage -> seconds, a stage that runs more than once is added up
+        self.bytes = {}  # What was measured (pixel_data, row_index, uncompressed, header) -> number of bytes
+        self.run_lengths = None  # Number of runs of each length, only worked out when asked for as it takes another pass over the pixels
+        self.entries = None  # For an atlas or animation, a dict for each bitmap or frame with its format and size
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            if trace_hook is not None:
+                trace_hook(self, name, seconds)
+
+    # Runs of 1 to 15 pixels fit in one compressed byte, anything longer is grouped together as it has to be split (or stored as an extended run)
+    def count_runs(self, run_lengths):
+        counts = numpy.bincount(numpy.minimum(numpy.asarray(run_lengths, dtype = numpy.int64), 16), minlength = 17)
+        self.run_lengths = {str(length): int(counts[length]) for length in range(1, 16)}
+        self.run_lengths["16+"] = int(counts[16])
+
+    # How many times smaller the stored pixel data (and row index) is than the uncompressed pixel data
+    def ratio(self):
+        stored_bytes = self.bytes.get("pixel_data", 0) + self.bytes.get("row_index", 0)
+        return self.bytes.get("uncompressed", 0) / stored_bytes if stored_bytes else 0.0
+
+    def as_dict(self):
+        return {
+            "source": None if self.source is None else str(self.source),
+            "output": None if self.output is None else str(self.output),
+            "format": self.data_format,
+            "width": self.image_width,
+            "height": self.image_height,
+            "seconds": dict(self.seconds),
+            "total_seconds": sum(self.seconds.values()),
+            "bytes": dict(self.bytes),
+            "ratio": self.ratio(),
+            "run_lengths": self.run_lengths,
+            "entries": self.entries,
+        }
+
+    # One line of JSON, so a log of many conversions can be read a line at a time
+    def json_line(self):
+        return json.dumps(self.as_dict())
+
+
+# Runs the code inside it under cProfile if a directory is given (or set in the RLE4BIT_PROFILE environment variable) and saves the results there as name.prof, which can be opened
+# with pstats or snakeviz. Without a directory it does nothing, so it costs nothing when profiling isn't wanted. Inside another profile it also does nothing (eg convert_image called by
+# batch.py), so the outer profile is the one that is saved and it holds all of the work
+@contextlib.contextmanager
+def profile(name, directory = None):
+    global _profiling
+    directory = directory or os.environ.get(PROFILE_ENVIRONMENT_VARIABLE)
+    if not directory or _profiling:
+        yield
+        return
+    profiler = cProfile.Profile()
+    _profiling = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _profiling = False
+        os.makedirs(directory, exist_ok = True)
+        profiler.dump_stats(os.path.join(directory, name + ".prof"))
@@ -1,9 +1,14 @@
+import io
+import mmap
 import os
+import struct
+import time
 
-import numpy as np
-from PIL import Image, ImageDraw
+from PIL import Image, ImageSequence
 import numpy
 
+import ConversionStats
+
 
 class RLE4Bit:
     # def __init__(self):
@@ -12,188 +17,659 @@ class RLE4Bit:
     _image_width = 0  # The number of pixels wide the image is
     _image_height = 0  # The number of pixels tall the image is
     _pixel_data = numpy.empty(1, dtype = numpy.uint8)  # The array to hold the pixel values that is read in from a bitmap
+    _image_path = None  # The file the pixel data was read from
+    _load_seconds = None  # How long reading the file took, reported in the stats of every conversion of it
+    _encoded_source = None  # The pixel data that the encoded data below was made from
+    _encoded = None  # (data_format, rows_per_tile, image_width) -> the image encoded in that format, made for each image when it is opened so it is never shared between converters
+    _HEX_BYTES = tuple(f"0x{value:02X}" for value in range(256))  # Lookup table of the text for every byte value, so the header doesn't need to format each byte
 
     def change_transparent_pixel_designator(self, new_designator):
         self._TRANSPARENT_PIXEL_DESIGNATOR = new_designator
 
-    def _uncompressed_convert(self, pixel_data):
-        uncompressed_pixel_data = numpy.empty(1, dtype = numpy.uint8)  # Create the array that will hold the uncompressed data
-
-        odd_pixel_data = self._pixel_data_2d # Create a copy of the data
-        if self._image_width % 2 == 1: # If the bitmap is an odd size
-            # Add a column full of transparent pixels to make it an even width
-            padding = np.ones((self._image_height, self._image_width + 1))
-            padding = padding * self._TRANSPARENT_PIXEL_DESIGNATOR
-            padding[:, :-1] = odd_pixel_data # Thanks: https://stackoverflow.com/questions/8486294/how-to-add-an-extra-column-to-a-numpy-array
-            odd_pixel_data = padding
-
-        # Next because the data is still in a 2D array, flatten it to the 1D array that is used when storing the data
-        odd_pixel_data = odd_pixel_data.flatten()
-        odd_pixel_data = odd_pixel_data.astype(numpy.uint8) # Make sure it is in the right datatype for doing the bitwise operations
-
-        uncompressed_index = 0  # This keeps track of the last checked index in the raw (input) array
-        for index in range(0, odd_pixel_data.size, 2):  # As each pixel must be translated from 0000gggg 0000GGGG to ggggGGGG format, go in increments of 2 to capture both at the same time
-            uncompressed_pixel_data.resize(uncompressed_index + 1, refcheck = False)  # Increase the output array size by 1 byte to accommodate the new pixels
-            # Set the newly allocated byte equal to the combined ggggGGGG format, but if there are bytes that have only a single pixel (eg for the byte at the end of a bitmap that has an
-            # odd number of pixels as a width), use the transparent pixel value
-            # uncompressed_pixel_data[uncompressed_index] = (odd_pixel_data[index] << 4) | (odd_pixel_data[index + 1] if index != odd_pixel_data.size - 1 else self._TRANSPARENT_PIXEL_DESIGNATOR)
-            uncompressed_pixel_data[uncompressed_index] = (odd_pixel_data[index] << 4) | (odd_pixel_data[index + 1])
-            # uncompressed_pixel_data[uncompressed_index] = (pixel_data[index] << 4) | (pixel_data[index + 1] if index != pixel_data.size - 1 else 0xF)
-            uncompressed_index += 1  # Increment the uncompressed output array index as the array is now one byte large due to the new addition
+    def _uncompressed_convert(self, pixel_data, output_buffer = None):
+        bytes_per_row = (self._image_width + 1) // 2  # If the bitmap is an odd width, the last byte of every row only holds a single pixel
+        size = bytes_per_row * self._image_height
+
+        if output_buffer is None:  # Create the array that will hold the uncompressed data, it is allocated once at its final size
+            uncompressed_pixel_data = numpy.empty(size, dtype = numpy.uint8)
+        else:  # Pack straight into the caller's buffer (bytearray, memoryview, numpy array, etc.) so the same allocation can be reused across many images
+            output_buffer = memoryview(output_buffer).cast('B')
+            if output_buffer.readonly or output_buffer.nbytes < size:
+                raise ValueError(f"Output buffer must be writable and at least {size} bytes, got {'a read only buffer' if output_buffer.readonly else str(output_buffer.nbytes) + ' bytes'}")
+            uncompressed_pixel_data = numpy.frombuffer(output_buffer, dtype = numpy.uint8, count = size)
+
+        # Work on the data as rows so that every row can be padded independently, making sure it is in the right datatype for doing the bitwise operations
+        rows = numpy.asarray(pixel_data).astype(numpy.uint8, copy = False).reshape(self._image_height, self._image_width)
+        output_rows = uncompressed_pixel_data.reshape(self._image_height, bytes_per_row)
+
+        # As each pixel must be translated from 0000gggg 0000GGGG to ggggGGGG format, the even columns are shifted into the upper 4 bits of every byte and the odd columns are OR'd into the lower 4 bits
+        numpy.left_shift(rows[:, 0::2], 4, out = output_rows)
+        numpy.bitwise_or(output_rows[:, :self._image_width // 2], rows[:, 1::2], out = output_rows[:, :self._image_width // 2])
+        if self._image_width % 2 == 1:  # If the bitmap is an odd size, the last byte of each row has no second pixel so it is filled with a transparent pixel
+            output_rows[:, -1] |= self._TRANSPARENT_PIXEL_DESIGNATOR & 0xF
 
         return uncompressed_pixel_data
 
-    # Does the same thing as the _uncompressed_convert but increments a counter instead
+    # Each row takes half its width in bytes (rounded up for odd widths), so the size can be calculated directly
     def uncompressed_size(self):
-        size = 0
-        for index in range(0, self._pixel_data.size, 2):
-            size += 1
-        return size
+        return ((self._image_width + 1) // 2) * self._image_height
+
+    # Finds every run of same 'color' pixels using array operations. If break_every is set, a new run is also started every break_every pixels even if the 'color' doesn't change,
+    # which keeps runs from crossing row or tile boundaries. Returns the index of the first pixel, the grayscale value and the length of each run
+    def _find_runs(self, pixel_data, break_every = 0):
+        pixel_data = numpy.asarray(pixel_data).ravel()
+        if pixel_data.size == 0:  # Nothing to compress, so there are no runs
+            return numpy.empty(0, dtype = numpy.int64), numpy.empty(0, dtype = numpy.uint8), numpy.empty(0, dtype = numpy.int64)
+        # A run starts at index 0 and at every pixel which is a different 'color' than the pixel before it
+        run_boundaries = pixel_data[1:] != pixel_data[:-1]
+        if break_every:
+            run_boundaries[break_every - 1::break_every] = True  # Index i of run_boundaries is the boundary before pixel i + 1
+        run_starts = numpy.concatenate(([0], numpy.flatnonzero(run_boundaries) + 1))
+        run_lengths = numpy.diff(numpy.append(run_starts, pixel_data.size))  # The distance between the starts of two runs is the length of the first one
+        return run_starts, pixel_data[run_starts], run_lengths
+
+    # Splits any run longer than 15 pixels into full chunks of 15 followed by the remainder, which is exactly how the ggggnnnn format has to store them.
+    # Returns the grayscale value and length of each chunk, so each entry corresponds to one compressed byte, along with how many chunks each run was split into
+    def _split_runs(self, run_values, run_lengths):
+        # As there are only 4 bits for storing the number of sequential pixels, each run is broken up into ceil(length / 15) bytes
+        chunk_counts = (run_lengths + 14) // 15
+        chunk_values = numpy.repeat(run_values, chunk_counts)  # Every byte of a split run has the same 'color'
+        chunk_lengths = numpy.full(chunk_values.size, 15, dtype = numpy.int64)  # All the bytes of a split run are full except for the last one
+        chunk_lengths[numpy.cumsum(chunk_counts) - 1] = run_lengths - (15 * (chunk_counts - 1))  # The last byte of each run holds whatever is left over
+        return chunk_values, chunk_lengths, chunk_counts
+
+    def _run_lengths(self, pixel_data, break_every = 0):
+        run_starts, run_values, run_lengths = self._find_runs(pixel_data, break_every)
+        return self._split_runs(run_values, run_lengths)[:2]
 
     def _compressed_convert(self, pixel_data):
-        compressed_array_index = 0  # This keeps track of where in the last index in the compressed (output) index
-        uncompressed_array_index = 0  # This keeps track of the last checked index in the raw (input) array
-        compressed_pixel_data = numpy.empty(1, dtype = numpy.uint8)  # Create the array that will hold the compressed data
-        while uncompressed_array_index < pixel_data.size:  # Keep compressing until the whole array has been read
-            sequential_pixels = 1  # This keeps track of how many pixels in a row are the same, it starts at 1 as there must be a minimum of 1 pixel to generate a compressed byte
-            # As the input data is stored like this: 0000gggg with the grayscale 'color' being the gggg, it must be shifted to the front of the byte as the compressed bytes have the
-            # structure: ggggnnnn where gggg is the grayscale 'color' and nnnn is the number of sequential pixels that are that value
-            grayscale_value = (pixel_data[uncompressed_array_index] << 4)
-            # While we haven't reached the end of the uncompressed array and while the next pixel is the same 'color' as the one currently being compressed
-            while (uncompressed_array_index < (pixel_data.size - 1)) and (pixel_data[uncompressed_array_index] == pixel_data[uncompressed_array_index + 1]):
-                if sequential_pixels < 15:  # As there are only 4 bits for storing the number of sequential pixels, make sure it doesn't keep going if it reaches that limit
-                    sequential_pixels += 1  # Since there are less than 15 current consecutive bytes, increment the sequential pixel variables to indicate another pixel of the same 'color'
-                    uncompressed_array_index += 1  # Move onto the next pixel so that it can be checked if it is the same as the last
-                else:  # There are more than 15 consecutive bytes, so start a new byte as the number portion of a byte is only 4 bits
-                    break
-            # Once the inner while loop breaks, we have either have a situation where more than 15 pixels are the same 'color', we have pixels that are different 'colors', or run out of pixels
-            uncompressed_array_index += 1  # First increment this to move onto the next pixel in the raw input buffer
-            compressed_pixel_data.resize(compressed_array_index + 1, refcheck = False)  # Increase the output array size by 1 byte to accommodate the new byte
-            compressed_pixel_data[compressed_array_index] = (grayscale_value | sequential_pixels)  # Store the new byte in the same ggggnnnn pattern as mentioned above
-            compressed_array_index += 1  # Increment the compressed array index as the array is now one byte large due to the new addition
-        # Once the outer while loop breaks, we know we have run out of pixels to compress so the entire array is returned
-        return compressed_pixel_data
-
-    # This method does exactly what the _compressed_convert method does, but just keeps track of the number of pixels, so refer to that function for details
+        grayscale_values, sequential_pixels = self._run_lengths(pixel_data)
+        # As the input data is stored like this: 0000gggg with the grayscale 'color' being the gggg, it must be shifted to the front of the byte as the compressed bytes have the
+        # structure: ggggnnnn where gggg is the grayscale 'color' and nnnn is the number of sequential pixels that are that value
+        return ((grayscale_values << 4) | sequential_pixels).astype(numpy.uint8)
+
     def compressed_size(self):
-        size = 0
-        uncompressed_array_index = 0
-        while uncompressed_array_index < self._pixel_data.size:
-            sequential_pixels = 1
-            while (uncompressed_array_index < (self._pixel_data.size - 1)) and (self._pixel_data[uncompressed_array_index] == self._pixel_data[uncompressed_array_index + 1]):
-                if sequential_pixels < 15:
-                    sequential_pixels += 1
-                    uncompressed_array_index += 1
-                else:  # There are more than 15 consecutive bytes, so start a new byte as the number portion of a byte is only 4 bits
-                    break
-            uncompressed_array_index += 1
-            size += 1  # Instead of adding pixels to a buffer, the size variable is just incremented
-        return size
+        return self._encoded_pixel_data("compressed").size
+
+    # Compresses the same way as _compressed_convert, but runs are broken at the start of every tile of rows_per_tile rows. This means decoding can start at the first byte of any tile,
+    # so the byte index that each tile starts at is returned as well to be stored in the header as the row index
+    def _row_compressed_convert(self, pixel_data, rows_per_tile = 1):
+        if rows_per_tile < 1:
+            raise ValueError(f"rows_per_tile must be at least 1, got {rows_per_tile}")
+        tile_size = self._image_width * rows_per_tile  # The number of pixels in each tile
+        run_starts, run_values, run_lengths = self._find_runs(pixel_data, tile_size)
+        grayscale_values, sequential_pixels, chunk_counts = self._split_runs(run_values, run_lengths)
+
+        # As runs never cross tile boundaries, every tile starts on a run, and the byte it starts at is the number of bytes used by all the runs before it
+        first_runs = numpy.searchsorted(run_starts, numpy.arange(0, numpy.asarray(pixel_data).size, tile_size))
+        row_index = numpy.concatenate(([0], numpy.cumsum(chunk_counts)))[first_runs].astype(numpy.uint16)
+        return ((grayscale_values << 4) | sequential_pixels).astype(numpy.uint8), row_index
+
+    # The size of the row indexed pixel data plus its row index, which holds a 2 byte offset for each tile
+    def row_compressed_size(self, rows_per_tile = 1):
+        if rows_per_tile < 1:
+            raise ValueError(f"rows_per_tile must be at least 1, got {rows_per_tile}")
+        pixel_data, row_index = self._encoded_pixel_data("compressed", rows_per_tile)
+        return pixel_data.size + (2 * row_index.size)
+
+    # How many more bytes the row indexed format takes than the normal compressed format, which includes both the index and the runs that had to be broken at tile boundaries
+    def row_index_overhead(self, rows_per_tile = 1):
+        return self.row_compressed_size(rows_per_tile) - self.compressed_size()
+
+    def row_compressed_pixel_data(self, rows_per_tile = 1):
+        pixel_data, row_index = self._encoded_pixel_data("compressed", rows_per_tile)
+        return pixel_data.copy(), row_index.copy()  # The kept data is shared by every conversion of the image, so the caller gets their own copy to change
+
+    # The extended format is a superset of the compressed format, any ggggnnnn byte with nnnn from 1 to 15 is a normal run. A byte with nnnn of 0 is an escape and the byte after it says what follows:
+    #   gggg0000 0LLLLLLL LLLLLLLL  A run of gggg that is the 15 bit length L + 16 pixels long (16 to 32783), so long runs take 3 bytes instead of one byte per 15 pixels
+    #   00000000 1LLLLLLL ...       A literal span of L + 1 pixels (1 to 128) packed two per byte in the uncompressed ggggGGGG format, so isolated pixels take half a byte instead of a whole one
+    _EXTENDED_RUN_MINIMUM = 16
+    _EXTENDED_RUN_MAXIMUM = 0x7FFF + 16
+    _LITERAL_SPAN_MAXIMUM = 128
+
+    # Adds a single run to the extended output, using 3 byte extended runs when that is smaller than the normal 15 pixel bytes
+    def _extended_run(self, output, grayscale_value, sequential_pixels):
+        while sequential_pixels > 45:  # Up to 45 pixels fit in 3 normal bytes, past that an extended run is smaller
+            length = min(sequential_pixels, self._EXTENDED_RUN_MAXIMUM) - self._EXTENDED_RUN_MINIMUM
+            output += bytes((grayscale_value << 4, length >> 8, length & 0xFF))
+            sequential_pixels -= length + self._EXTENDED_RUN_MINIMUM
+        while sequential_pixels > 0:  # Whatever is left is stored the same way as the normal compressed format
+            output.append((grayscale_value << 4) | min(sequential_pixels, 15))
+            sequential_pixels -= min(sequential_pixels, 15)
+
+    # Adds a literal span of pixels to the extended output, split into spans of at most 128 pixels
+    def _extended_literal(self, output, pixels):
+        for span_start in range(0, pixels.size, self._LITERAL_SPAN_MAXIMUM):
+            span = pixels[span_start:span_start + self._LITERAL_SPAN_MAXIMUM]
+            output += bytes((0x00, 0x80 | (span.size - 1)))
+            packed = numpy.zeros((span.size + 1) // 2, dtype = numpy.uint8)  # If there is an odd number of pixels, the lower 4 bits of the last byte are left as 0
+            packed |= span[0::2] << 4
+            packed[:span.size // 2] |= span[1::2]
+            output += packed.tobytes()
+
+    def _extended_compressed_convert(self, pixel_data):
+        pixel_data = numpy.asarray(pixel_data).astype(numpy.uint8, copy = False).ravel()
+        run_starts, run_values, run_lengths = self._find_runs(pixel_data)
+        run_starts, run_values, run_lengths = run_starts.tolist(), run_values.tolist(), run_lengths.tolist()
+        output = bytearray()
+        run_index = 0
+        while run_index < len(run_lengths):
+            if run_lengths[run_index] > 2:  # Longer runs are always stored as runs
+                self._extended_run(output, run_values[run_index], run_lengths[run_index])
+                run_index += 1
+                continue
+
+            # Collect every short run in a row, as they can either be stored as normal runs (1 byte each) or together as literal spans (2 bytes + half a byte per pixel for each span)
+            span_end = run_index
+            while span_end < len(run_lengths) and run_lengths[span_end] <= 2:
+                span_end += 1
+            span_pixels = run_starts[span_end - 1] + run_lengths[span_end - 1] - run_starts[run_index]
+            full_spans, remaining_pixels = divmod(span_pixels, self._LITERAL_SPAN_MAXIMUM)
+            literal_size = full_spans * (2 + self._LITERAL_SPAN_MAXIMUM // 2) + ((2 + (remaining_pixels + 1) // 2) if remaining_pixels else 0)
+            if literal_size < span_end - run_index:
+                self._extended_literal(output, pixel_data[run_starts[run_index]:run_starts[run_index] + span_pixels])
+            else:
+                for short_run in range(run_index, span_end):
+                    output.append((run_values[short_run] << 4) | run_lengths[short_run])
+            run_index = span_end
+        return numpy.frombuffer(bytes(output), dtype = numpy.uint8)
+
+    def extended_compressed_size(self):
+        return self._encoded_pixel_data("extended").size
+
+    def extended_compressed_pixel_data(self):
+        return self._encoded_pixel_data("extended").copy()
+
+    # Encodes the opened image in the compressed (row indexed if rows_per_tile is set) or extended format the first time it is asked for and keeps the result, as the sizes, the smallest
+    # format and the conversion all need the same data. Neither format depends on the transparent pixel designator, so it never has to be encoded again for the same pixels.
+    # Opening an image starts with nothing kept, changing _pixel_data in place isn't noticed so it should be replaced (or the image opened again) instead
+    def _encoded_pixel_data(self, data_format, rows_per_tile = 0):
+        if self._encoded is None or self._encoded_source is not self._pixel_data:  # The pixels were set without opening an image (or replaced), so anything kept is for the old ones
+            self._encoded_source, self._encoded = self._pixel_data, {}
+        key = (data_format, rows_per_tile, self._image_width)  # Row indexed runs are broken every rows_per_tile rows, which depends on the width
+        if key not in self._encoded:
+            if data_format == "extended":
+                encoded = self._extended_compressed_convert(self._pixel_data)
+            elif rows_per_tile:
+                encoded = self._row_compressed_convert(self._pixel_data, rows_per_tile)
+            else:
+                encoded = self._compressed_convert(self._pixel_data)
+            for array in (encoded if isinstance(encoded, tuple) else (encoded,)):
+                array.flags.writeable = False  # The same array is handed to every caller, so none of them can change it for the others
+            self._encoded[key] = encoded
+        return self._encoded[key]
+
+    # Picks whichever format stores the bitmap in the fewest bytes: "uncompressed", "compressed" or "extended". As with the UI, a format is only picked over a simpler one if it is smaller.
+    # If rows_per_tile is set the compressed size is that of the row indexed data including its index, and as the extended format has no row index it is not considered
+    def smallest_format(self, rows_per_tile = 0):
+        if rows_per_tile:
+            sizes = {"uncompressed": self.uncompressed_size(), "compressed": self.row_compressed_size(rows_per_tile)}
+        else:
+            sizes = {"uncompressed": self.uncompressed_size(), "compressed": self.compressed_size(), "extended": self.extended_compressed_size()}
+        return min(sizes, key = sizes.get)  # min keeps the first of any formats that are the same size, which is the simplest one
+
+    # Encodes the opened image in one of the formats returned by smallest_format
+    def _convert_format(self, data_format):
+        if data_format in ("compressed", "extended"):
+            return self._encoded_pixel_data(data_format)
+        return self._uncompressed_convert(self._pixel_data)
+
+    # The decoders below undo each format in Python, returning the pixels as 0000gggg values in the same order as _pixel_data. They are the reference used to check that encoding is lossless
+    def _uncompressed_decode(self, uncompressed_pixel_data, image_width, image_height):
+        bytes_per_row = (image_width + 1) // 2
+        pixel_pairs = numpy.asarray(uncompressed_pixel_data, dtype = numpy.uint8).reshape(image_height, bytes_per_row)
+        pixels = numpy.empty((image_height, bytes_per_row * 2), dtype = numpy.uint8)
+        pixels[:, 0::2] = pixel_pairs >> 4  # Even pixels are in the upper 4 bits
+        pixels[:, 1::2] = pixel_pairs & 0xF  # Odd pixels are in the lower 4 bits
+        return pixels[:, :image_width].ravel()  # Drop the padding pixel at the end of each row of an odd width image
+
+    # Works for both the compressed and row indexed formats, as the row index is stored separately and the runs are the same ggggnnnn bytes
+    def _compressed_decode(self, compressed_pixel_data):
+        compressed_pixel_data = numpy.asarray(compressed_pixel_data, dtype = numpy.uint8)
+        return numpy.repeat(compressed_pixel_data >> 4, compressed_pixel_data & 0xF)
+
+    def _extended_decode(self, extended_pixel_data):
+        extended_pixel_data = numpy.asarray(extended_pixel_data, dtype = numpy.uint8)
+        data = extended_pixel_data.tolist()
+        pieces = []
+        index = 0
+        while index < len(data):
+            grayscale_value, sequential_pixels = data[index] >> 4, data[index] & 0xF
+            index += 1
+            if sequential_pixels == 0:  # An escape, the next byte says whether it is a long run or a literal span
+                if data[index] & 0x80:  # A literal span of packed pixels
+                    literal_pixels = (data[index] & 0x7F) + 1
+                    literal_bytes = (literal_pixels + 1) // 2
+                    pieces.append(self._uncompressed_decode(extended_pixel_data[index + 1:index + 1 + literal_bytes], literal_pixels, 1))
+                    index += 1 + literal_bytes
+                    continue
+                sequential_pixels = ((data[index] << 8) | data[index + 1]) + self._EXTENDED_RUN_MINIMUM  # A long run
+                index += 2
+            pieces.append(numpy.full(sequential_pixels, grayscale_value, dtype = numpy.uint8))
+        return numpy.concatenate(pieces) if pieces else numpy.empty(0, dtype = numpy.uint8)
+
+    # Applies a delta frame to a copy of the previous frame's pixels, the reference for checking _delta_convert
+    def _delta_decode(self, delta_pixel_data, previous_pixel_data):
+        pixel_data = numpy.array(previous_pixel_data, dtype = numpy.uint8).ravel()
+        data = numpy.asarray(delta_pixel_data, dtype = numpy.uint8).tolist()
+        index = 0
+        position = 0  # The pixel the next byte applies to
+        while index < len(data):
+            grayscale_value, sequential_pixels = data[index] >> 4, data[index] & 0xF
+            if sequential_pixels == 0:  # A skip, the pixels keep their value from the previous frame
+                position += ((grayscale_value << 8) | data[index + 1]) + 1
+                index += 2
+                continue
+            pixel_data[position:position + sequential_pixels] = grayscale_value
+            position += sequential_pixels
+            index += 1
+        return pixel_data
 
     def open_image(self, input_image_name):
+        start_time = time.perf_counter()
         self._image_width, self._image_height, self._pixel_data = self._open_image(input_image_name)  # Read all the data required from the file when opening it
+        self._load_seconds = time.perf_counter() - start_time
+        self._image_path = input_image_name
+        self._encoded_source, self._encoded = self._pixel_data, {}  # Nothing kept from a previous image (or an earlier version of this file) is used again
 
-    def uncompressed_pixel_data(self):
-        return self._uncompressed_convert(self._pixel_data)
+    def uncompressed_pixel_data(self, output_buffer = None):
+        return self._uncompressed_convert(self._pixel_data, output_buffer)
 
     def compressed_pixel_data(self):
-        return self._compressed_convert(self._pixel_data)
+        return self._encoded_pixel_data("compressed").copy()  # The kept data is shared by every conversion of the image, so the caller gets their own copy to change
 
-    def convert_image(self, filepath, has_transparency, transparent_pixel_designator = 0x0, compress = True, save = True):
-        if not save:
-            if compress:
-                print("Compressed size: " + str(self.compressed_size()))
-                compressed_pixel_data = self._compressed_convert(self._pixel_data)
-                return self._generate_output_string(image_width = self._image_width, image_height = self._image_height, pixel_data = compressed_pixel_data, file_path = filepath, transparency = has_transparency,
-                                                    transparent_pixel_designator = transparent_pixel_designator, compress = True)
-                # return compressed_pixel_data  # Return the compressed array in case it needs to be used elsewhere
+    _DATA_FORMATS = ("auto", "uncompressed", "compressed", "extended")
+
+    # Returns whether the header was written (if save is set) or the header itself. If return_stats is set, a ConversionStats with the timing of each stage, the size of each part of the
+    # output, and a histogram of the run lengths is returned along with it. Passing stats fills in that ConversionStats instead (eg one that already timed a cache lookup).
+    # data_format can be given instead of compress and extended, it is one of _DATA_FORMATS and auto picks whichever is smallest with smallest_format.
+    # Setting the RLE4BIT_PROFILE environment variable to a directory also saves a cProfile of the conversion there
+    def convert_image(self, filepath, has_transparency, transparent_pixel_designator = 0x0, compress = True, save = True, bytes_per_line = 10, rows_per_tile = 0, extended = False,
+                      return_stats = False, data_format = None, stats = None):
+        if data_format is not None and data_format not in self._DATA_FORMATS:
+            raise ValueError(f"data_format must be one of {', '.join(self._DATA_FORMATS)}, got {data_format}")
+        caller_stats = stats is not None  # The run histogram takes another pass over the pixels, so it is only worked out if someone will read the stats
+        if stats is None:
+            stats = ConversionStats.ConversionStats(source = self._image_path, output = filepath)
+        stats.image_width, stats.image_height = self._image_width, self._image_height
+        if self._load_seconds is not None:
+            stats.seconds.setdefault("load", self._load_seconds)  # Left alone if the caller already timed loading the image
+
+        with ConversionStats.profile(os.path.basename(str(filepath)).partition('.')[0]):
+            if data_format == "auto":
+                with stats.stage("rle"):  # Working out the sizes encodes the image in each format, the one that is picked is kept so it isn't encoded again below
+                    data_format = self.smallest_format(rows_per_tile)
+            if data_format is not None:
+                compress, extended = data_format != "uncompressed", data_format == "extended"
+
+            row_index = None
+            extended = compress and extended  # The extended format is only a different way of compressing, so it does nothing for uncompressed data
+            if extended:  # Use the extended format with literal spans and long runs
+                stats.data_format = "extended"
+                with stats.stage("rle"):
+                    pixel_data = self._encoded_pixel_data("extended")
+            elif compress and rows_per_tile:  # Break the runs at every tile of rows_per_tile rows and add a row index so the bitmap can be decoded starting from any tile
+                stats.data_format = "row_indexed"
+                with stats.stage("rle"):
+                    pixel_data, row_index = self._encoded_pixel_data("compressed", rows_per_tile)
+                stats.bytes["row_index"] = 2 * int(row_index.size)
+            elif compress:
+                stats.data_format = "compressed"
+                with stats.stage("rle"):
+                    pixel_data = self._encoded_pixel_data("compressed")
             else:
-                print("Uncompressed size: " + str(self.uncompressed_size()))
-                uncompressed_pixel_data = self._uncompressed_convert(self._pixel_data)
-                return self._generate_output_string(image_width = self._image_width, image_height = self._image_height, pixel_data = uncompressed_pixel_data, file_path = filepath, transparency = has_transparency,
-                                                    transparent_pixel_designator = transparent_pixel_designator, compress = False)
-                # return uncompressed_pixel_data  # Return the uncompressed array of pixels
-        else:
-            if compress:
-                print("Compressed size: " + str(self.compressed_size()))
-                compressed_pixel_data = self._compressed_convert(self._pixel_data)
-                return self._write_to_hpp(image_width = self._image_width, image_height = self._image_height, pixel_data = compressed_pixel_data, file_path = filepath, transparency = has_transparency,
-                                          transparent_pixel_designator = transparent_pixel_designator, compress = True)
-                # return compressed_pixel_data  # Return the compressed array in case it needs to be used elsewhere
+                stats.data_format = "uncompressed"
+                with stats.stage("pack"):
+                    pixel_data = self._uncompressed_convert(self._pixel_data)
+            stats.bytes["pixel_data"] = int(pixel_data.size)
+            stats.bytes["uncompressed"] = self.uncompressed_size()
+
+            # Either write the header straight to the file or return it as a string (eg for the UI preview)
+            header_arguments = dict(image_width = self._image_width, image_height = self._image_height, pixel_data = pixel_data, file_path = filepath, transparency = has_transparency,
+                                    transparent_pixel_designator = transparent_pixel_designator, compress = compress, bytes_per_line = bytes_per_line, row_index = row_index,
+                                    rows_per_tile = rows_per_tile if row_index is not None else 0, extended = extended)
+            if save:
+                result = self._write_to_hpp(**header_arguments, stats = stats)
+                stats.bytes["header"] = os.path.getsize(str(filepath))
             else:
-                print("Uncompressed size: " + str(self.uncompressed_size()))
-                uncompressed_pixel_data = self._uncompressed_convert(self._pixel_data)
-                return self._write_to_hpp(image_width = self._image_width, image_height = self._image_height, pixel_data = uncompressed_pixel_data, file_path = filepath, transparency = has_transparency,
-                                          transparent_pixel_designator = transparent_pixel_designator, compress = False)
-                # return uncompressed_pixel_data  # Return the uncompressed array of pixels
+                with stats.stage("header"):
+                    result = self._generate_output_string(**header_arguments)
+                stats.bytes["header"] = len(result)
 
-    def _generate_image_from_array(self, image_width, image_height, pixel_data):
-        rendered_image = Image.new("L", (image_width, image_height))  # This is a temporary image which is used to render a preview of the bitmap once it has been processed and reconstructed
+        if not return_stats and not caller_stats:
+            return result
+        stats.count_runs(self._find_runs(self._pixel_data)[2])
+        return (result, stats) if return_stats else result
+
+    # Converts many images into a single header holding one array of pixel data and a table of where each image is stored in it, any images that encode to the same data share it.
+    # Each image is stored in whichever format is smallest unless data_format ("uncompressed", "compressed" or "extended") is given. Returns the same as convert_image, and if return_stats
+    # is set, a ConversionStats whose entries hold the name, format, offset and size of each image
+    def convert_atlas(self, image_paths, filepath, has_transparency, transparent_pixel_designator = "0x0", save = True, bytes_per_line = 10, data_format = None, return_stats = False):
+        stats = ConversionStats.ConversionStats(output = filepath)
+        stats.data_format = "atlas"
+        encoded_images = []
+        uncompressed_size = 0
+        for image_path in image_paths:
+            image = RLE4Bit()  # Each image gets its own converter so the one holding the atlas settings is left alone
+            with stats.stage("load"):
+                image.open_image(image_path)
+            image.change_transparent_pixel_designator(self._TRANSPARENT_PIXEL_DESIGNATOR)  # Used to pad odd width images, the same as convert_image
+            with stats.stage("rle"):
+                image_format = data_format if data_format else image.smallest_format()
+                encoded_images.append((os.path.basename(image_path).partition('.')[0], image._image_width, image._image_height, image_format, image._convert_format(image_format)))
+            uncompressed_size += image.uncompressed_size()
+
+        pixel_data, entries = self._pack_atlas(encoded_images)
+        stats.bytes["pixel_data"] = int(pixel_data.size)
+        stats.bytes["before_deduplication"] = sum(int(entry["size"]) for entry in entries)
+        stats.bytes["uncompressed"] = uncompressed_size
+        stats.entries = [dict(entry, format = encoded_image[3]) for entry, encoded_image in zip(entries, encoded_images)]
+        result = self._save_atlas_output(stats, pixel_data, entries, filepath, has_transparency, transparent_pixel_designator, save, bytes_per_line)
+        return (result, stats) if return_stats else result
+
+    # Emits the header of an atlas or animation and either writes it or returns it, the same as convert_image
+    def _save_atlas_output(self, stats, pixel_data, entries, filepath, has_transparency, transparent_pixel_designator, save, bytes_per_line):
+        output_string = io.StringIO()
+        with stats.stage("header"):
+            self._emit_atlas_output(output_string, pixel_data, entries, filepath, has_transparency, transparent_pixel_designator, bytes_per_line)
+        stats.bytes["header"] = len(output_string.getvalue())
+        if not save:
+            return output_string.getvalue()
+        with stats.stage("write"):
+            return self.write_header(filepath, output_string.getvalue())
+
+    _ATLAS_FLAGS = {"uncompressed": 0b000, "compressed": 0b001, "extended": 0b011, "delta": 0b101}  # Matches BITMAP_ATLAS_COMPRESSED, BITMAP_ATLAS_EXTENDED and BITMAP_ATLAS_DELTA in Bitmap.hpp
+
+    # Packs already encoded images, given as (name, width, height, data_format, pixel_data), into one array. Returns the array and the table entry for each image
+    def _pack_atlas(self, encoded_images):
+        offsets = {}  # The offset of each unique set of pixel data that has been packed so far
+        unique_pixel_data = []
+        packed_size = 0
+        entries = []
+        used_names = set()
+        for name, image_width, image_height, data_format, pixel_data in encoded_images:
+            pixel_data = numpy.asarray(pixel_data, dtype = numpy.uint8)
+            pixel_bytes = pixel_data.tobytes()
+            if pixel_bytes not in offsets:  # Only the first image with this data adds it to the array, the rest point to the same place
+                offsets[pixel_bytes] = packed_size
+                unique_pixel_data.append(pixel_data)
+                packed_size += pixel_data.size
+
+            unique_name = name
+            duplicate_number = 2
+            while unique_name in used_names:  # Images with the same file name (eg from different directories) still need different constants in the header
+                unique_name = name + "_" + str(duplicate_number)
+                duplicate_number += 1
+            used_names.add(unique_name)
+
+            entries.append({"name": unique_name, "offset": offsets[pixel_bytes], "size": pixel_data.size, "width": image_width, "height": image_height, "flags": self._ATLAS_FLAGS[data_format]})
+        packed_pixel_data = numpy.concatenate(unique_pixel_data) if unique_pixel_data else numpy.empty(0, dtype = numpy.uint8)
+        return packed_pixel_data, entries
+
+    def _emit_atlas_output(self, outfile, pixel_data, entries, file_path, transparency, transparent_pixel_designator, bytes_per_line = 10):
+        if bytes_per_line < 1:
+            raise ValueError(f"bytes_per_line must be at least 1, got {bytes_per_line}")
+        transparent_pixel_designator = self._designator_text(transparent_pixel_designator)
+        file_name, dot, extension = os.path.basename(file_path).partition('.')
+        outfile.write("#ifndef " + file_name.upper() + "_HPP" + "\n#define " + file_name.upper() + "_HPP\n")  # Include guard
+        outfile.write("#include \"Bitmap/Bitmap.hpp\"\n\n")  # Struct base defintion file
+        for index, entry in enumerate(entries):  # A constant for each image to pass to the atlas's bitmap method
+            outfile.write("constexpr uint16_t " + file_name.upper() + "_" + entry["name"].upper() + " = " + str(index) + ";\n")
+        outfile.write("\nstatic const BitmapAtlas<" + str(pixel_data.size) + ", " + str(len(entries)) + "> " + file_name + "{\n")  # Struct instance definition with template filled in
+        outfile.write(".transparency = " + str(transparency).lower() + ",\n")  # Whether or not the bitmaps use transparency
+        outfile.write(".transparent_pixel_designator = " + transparent_pixel_designator + ",\n")  # What pixel is reserved for transparency
+        outfile.write(".entries = {{\n")
+        for entry in entries:  # Where each image's data is stored in the pixel_data array
+            outfile.write("{.offset = " + str(entry["offset"]) + ", .size = " + str(entry["size"]) + ", .width = " + str(entry["width"]) + ", .height = " + str(entry["height"]) +
+                          ", .flags = " + f"0x{entry['flags']:X}" + "},  // " + entry["name"] + "\n")
+        outfile.write("}},\n")
+        outfile.write(".pixel_data = {\n")
+        self._emit_array(outfile, numpy.asarray(pixel_data, dtype = numpy.uint8).ravel().tolist(), self._HEX_BYTES.__getitem__, bytes_per_line)
+        outfile.write("\n};\n#endif // " + file_name.upper() + "_HPP\n")
+
+    _DELTA_SKIP_MAXIMUM = 0x1000  # A skip stores its length - 1 in 12 bits
+
+    # Encodes only the pixels that changed since the previous frame. Changed pixels are stored as normal ggggnnnn runs, a byte with a run length of 0 is a skip instead: gggg0000 LLLLLLLL
+    # leaves the next ggggLLLLLLLL + 1 pixels as they were. Any unchanged pixels at the end of the frame are left out entirely
+    def _delta_convert(self, previous_pixel_data, pixel_data):
+        pixel_data = numpy.asarray(pixel_data, dtype = numpy.uint8).ravel()
+        changed = (pixel_data != numpy.asarray(previous_pixel_data, dtype = numpy.uint8).ravel()).astype(numpy.uint8)
+        if not changed.any():
+            return numpy.empty(0, dtype = numpy.uint8)
+
+        # Gaps of 1 or 2 unchanged pixels between changed ones are drawn again instead of skipped, as that never takes more than the 2 bytes of a skip
+        run_starts, run_values, run_lengths = self._find_runs(changed)
+        small_gaps = (run_values == 0) & (run_lengths <= 2)
+        small_gaps[[0, -1]] = False  # Unchanged pixels at the start and end of the frame aren't between changed ones
+        drawn = numpy.repeat(run_values | small_gaps, run_lengths).astype(bool)
+
+        # Every skipped pixel is given the same value (16, which no pixel can be) so each span of them is found as a single run, and the trailing span is dropped
+        last_drawn = numpy.flatnonzero(drawn)[-1] + 1
+        run_starts, run_values, run_lengths = self._find_runs(numpy.where(drawn, pixel_data, 16)[:last_drawn])
+
+        # Split runs of pixels into bytes of up to 15 and skips into pairs of bytes of up to _DELTA_SKIP_MAXIMUM, the same way _split_runs does
+        skips = run_values == 16
+        chunk_limits = numpy.where(skips, self._DELTA_SKIP_MAXIMUM, 15)
+        chunk_counts = (run_lengths + chunk_limits - 1) // chunk_limits
+        chunk_values = numpy.repeat(run_values.astype(numpy.int64), chunk_counts)
+        chunk_lengths = numpy.repeat(chunk_limits, chunk_counts)
+        chunk_lengths[numpy.cumsum(chunk_counts) - 1] = run_lengths - (chunk_limits * (chunk_counts - 1))
+        chunk_skips = chunk_values == 16
 
-        draw = ImageDraw.Draw(rendered_image)  # Create the object to draw the pixels
+        # Skips take 2 bytes and runs take 1, so that decides where each chunk's bytes go
+        chunk_bytes = numpy.where(chunk_skips, 2, 1)
+        positions = numpy.cumsum(chunk_bytes) - chunk_bytes
+        delta_pixel_data = numpy.empty(int(chunk_bytes.sum()), dtype = numpy.uint8)
+        delta_pixel_data[positions] = numpy.where(chunk_skips, ((chunk_lengths - 1) >> 8) << 4, (chunk_values << 4) | chunk_lengths)
+        delta_pixel_data[positions[chunk_skips] + 1] = (chunk_lengths[chunk_skips] - 1) & 0xFF
+        return delta_pixel_data
 
-        # Draws a single pixel in 8 bit grayscale from a 4 bit grayscale input
-        def DrawPixel(x, y, grayscale):
-            shape = [(x, y), (x, y)]
-            draw.rectangle(shape, fill = int(numpy.interp(grayscale, [0, 15], [0, 255])))
+    # Reads the frames of an animation, either from one animated image (eg a GIF) or from one bitmap per frame, returns the size they all share and each frame's pixels
+    def _open_frames(self, image_paths):
+        frames = []
+        for image_path in image_paths:
+            if str(image_path).lower().endswith(".bmp"):  # A bitmap is a single frame whose palette indexes are already the grayscale values
+                frames.append(self._open_image(image_path))
+                continue
+            with Image.open(image_path, 'r') as input_image:
+                for frame in ImageSequence.Iterator(input_image):
+                    # GIF palettes can be in any order, so go through 8 bit grayscale and round each pixel to the closest of the 16 levels
+                    gray_data = numpy.asarray(frame.convert("L"), dtype = numpy.uint16)
+                    frames.append((frame.width, frame.height, ((gray_data + 8) // 17).astype(numpy.uint8).reshape(-1)))
+        if not frames:
+            raise ValueError("An animation needs at least one frame")
+        image_width, image_height = frames[0][:2]
+        for frame_number, (frame_width, frame_height, _) in enumerate(frames):
+            if (frame_width, frame_height) != (image_width, image_height):
+                raise ValueError(f"Every frame must be the same size, frame {frame_number} is {frame_width}x{frame_height} but the first is {image_width}x{image_height}")
+        return image_width, image_height, [pixel_data for _, _, pixel_data in frames]
 
-        for row in range(image_width):
-            for column in range(image_height):
-                DrawPixel(row, column, pixel_data[(column * 128) + row])  # Draw each pixel in the array to the temporary image
+    # Encodes each frame as a delta against the one before it, or as a keyframe if the delta isn't smaller (the first frame is always a keyframe). Returns the frames in the form
+    # _pack_atlas takes, and the size of each frame as both a keyframe and a delta (None for the first frame)
+    def _encode_animation(self, frames, image_width, image_height):
+        encoded_frames = []
+        frame_sizes = []
+        previous_pixel_data = None
+        for frame_number, pixel_data in enumerate(frames):
+            # Keyframes use whichever of the compressed and extended formats is smaller, as those are the formats the decompression methods can draw
+            keyframe_format, keyframe_pixel_data = "compressed", self._compressed_convert(pixel_data)
+            extended_pixel_data = self._extended_compressed_convert(pixel_data)
+            if extended_pixel_data.size < keyframe_pixel_data.size:
+                keyframe_format, keyframe_pixel_data = "extended", extended_pixel_data
 
-        # rendered_image.show()  # Display the temporary image
-        return rendered_image
+            data_format, frame_pixel_data, delta_size = keyframe_format, keyframe_pixel_data, None
+            if previous_pixel_data is not None:
+                delta_pixel_data = self._delta_convert(previous_pixel_data, pixel_data)
+                delta_size = int(delta_pixel_data.size)
+                if delta_pixel_data.size < keyframe_pixel_data.size:
+                    data_format, frame_pixel_data = "delta", delta_pixel_data
 
-    def _generate_output_string(self, image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress):
+            encoded_frames.append(("frame_" + str(frame_number), image_width, image_height, data_format, frame_pixel_data))
+            frame_sizes.append({"frame": frame_number, "format": data_format, "bytes": int(frame_pixel_data.size), "keyframe_bytes": int(keyframe_pixel_data.size), "delta_bytes": delta_size})
+            previous_pixel_data = pixel_data
+        return encoded_frames, frame_sizes
+
+    # Converts a sequence of frames (an animated GIF, or numbered bitmaps given in order) into one BitmapAtlas header with an entry per frame, which DecompressFrame draws in order.
+    # Returns the same as convert_image, and if return_stats is set, a ConversionStats whose entries hold the size of each frame as stored, as a keyframe, and as a delta
+    def convert_animation(self, image_paths, filepath, has_transparency, transparent_pixel_designator = "0x0", save = True, bytes_per_line = 10, return_stats = False):
+        if isinstance(image_paths, (str, os.PathLike)):  # A single animated image
+            image_paths = [image_paths]
+        stats = ConversionStats.ConversionStats(output = filepath)
+        stats.data_format = "animation"
+        with stats.stage("load"):
+            image_width, image_height, frames = self._open_frames(image_paths)
+        stats.image_width, stats.image_height = image_width, image_height
+        with stats.stage("rle"):
+            encoded_frames, frame_sizes = self._encode_animation(frames, image_width, image_height)
+        pixel_data, entries = self._pack_atlas(encoded_frames)  # Frames with the same data, like the deltas of a looping spinner, are only stored once
+
+        stats.bytes["pixel_data"] = int(pixel_data.size)
+        stats.bytes["keyframes_only"] = sum(frame_size["keyframe_bytes"] for frame_size in frame_sizes)
+        stats.bytes["uncompressed"] = ((image_width + 1) // 2) * image_height * len(frames)
+        stats.entries = [dict(frame_size, offset = entry["offset"]) for frame_size, entry in zip(frame_sizes, entries)]
+        result = self._save_atlas_output(stats, pixel_data, entries, filepath, has_transparency, transparent_pixel_designator, save, bytes_per_line)
+        return (result, stats) if return_stats else result
+
+    _PREVIEW_PALETTE = numpy.repeat(numpy.arange(16, dtype = numpy.uint8)[:, None] * 17, 3, axis = 1)  # RGB for each 4 bit grayscale value, 0x0 is black and 0xF is white
+    _PREVIEW_TRANSPARENT_COLOR = (0xFF, 0x00, 0x00)  # Transparent pixels are shown in red
+
+    # Maps every 0000gggg pixel through the preview palette at once, giving a (height, width, 3) RGB array. If transparent_pixel_designator is given, those pixels are shown in red
+    def _preview_rgb(self, pixel_data, image_width, image_height, transparent_pixel_designator = None):
+        palette = self._PREVIEW_PALETTE
+        if transparent_pixel_designator is not None:
+            palette = palette.copy()
+            palette[transparent_pixel_designator & 0xF] = self._PREVIEW_TRANSPARENT_COLOR
+        return palette[numpy.asarray(pixel_data, dtype = numpy.uint8).reshape(image_height, image_width) & 0xF]
+
+    # The preview as binary PPM data, which Tk's PhotoImage can load in a single call instead of setting each pixel
+    def _preview_ppm(self, pixel_data, image_width, image_height, transparent_pixel_designator = None):
+        return f"P6 {image_width} {image_height} 255\n".encode("ascii") + self._preview_rgb(pixel_data, image_width, image_height, transparent_pixel_designator).tobytes()
+
+    def _generate_image_from_array(self, image_width, image_height, pixel_data):
+        # Scale each 4 bit grayscale value up to 8 bits (0xF * 17 = 0xFF) and build the image from the whole array at once
+        return Image.fromarray(self._PREVIEW_PALETTE[numpy.asarray(pixel_data, dtype = numpy.uint8).reshape(image_height, image_width) & 0xF, 0])
+
+    def _generate_output_string(self, image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress, bytes_per_line = 10, row_index = None,
+                                rows_per_tile = 0, extended = False):
+        output_string = io.StringIO()  # The emitter writes to any file object, so collect it in memory when the whole string is needed (eg for the UI preview)
+        self._emit_output(output_string, image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress, bytes_per_line, row_index, rows_per_tile,
+                          extended)
+        return output_string.getvalue()
+
+    # The designator as it is written in the header. The UI passes the text from its drop down (eg "0xA") which is used as is, a number is written the same way
+    def _designator_text(self, transparent_pixel_designator):
+        if isinstance(transparent_pixel_designator, str):
+            return transparent_pixel_designator
+        return f"0x{transparent_pixel_designator:X}"
+
+    # Writes the values of an array bytes_per_line at a time, separated by commas, and closes the array's brackets after the last value.
+    # Returns whether the last line was full, as the original layout placed a newline at the very end of the header only in that case
+    def _emit_array(self, outfile, values, value_to_text, bytes_per_line):
+        for line_start in range(0, len(values), bytes_per_line):
+            line = ", ".join(map(value_to_text, values[line_start:line_start + bytes_per_line]))
+            if line_start + bytes_per_line < len(values):  # There is another value following this line so place a comma
+                outfile.write(line + ", \n")
+            else:  # We have reached the end of the array, place the closing bracket
+                outfile.write(line + "},")
+        if not values:  # Still close the array if there is no data
+            outfile.write("},")
+        return len(values) > 0 and len(values) % bytes_per_line == 0
+
+    # Writes the header to a file object one line at a time so the whole header never has to be built in memory before it is written
+    def _emit_output(self, outfile, image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress, bytes_per_line = 10, row_index = None,
+                     rows_per_tile = 0, extended = False):
+        if bytes_per_line < 1:
+            raise ValueError(f"bytes_per_line must be at least 1, got {bytes_per_line}")
+        transparent_pixel_designator = self._designator_text(transparent_pixel_designator)
         # This adds the required include guards, includes, and other struct members to the header file string
         # Thanks https://stackoverflow.com/questions/8384737/extract-file-name-from-path-no-matter-what-the-os-path-format
         # and https://stackoverflow.com/questions/904746/how-to-remove-all-characters-after-a-specific-character-in-python
         file_name, dot, extension = os.path.basename(file_path).partition('.')
-        compressed_string = ""
-        compressed_string += "#ifndef " + file_name.upper() + "_HPP" + "\n#define " + file_name.upper() + "_HPP\n"  # Include guard
-        compressed_string += "#include \"Bitmap/Bitmap.hpp\"\n\n"  # Struct base defintion file
-        compressed_string += "static const Bitmap<" + str(pixel_data.size) + "> " + file_name + "{\n"  # Struct instance definition with template filled in
-        compressed_string += ".width = " + str(image_width) + ",\n"  # Picture width
-        compressed_string += ".height = " + str(image_height) + ",\n"  # Picture height
-        compressed_string += ".size = " + str(pixel_data.size) + ",\n"  # Number of bytes in the pixel_data array
-        compressed_string += ".transparency = " + str(transparency).lower() + ",\n"  # Whether or not the bitmap uses transparency
-        # compressed_string += ".transparent_pixel_designator = " + f"0x{transparent_pixel_designator:X}" + ",\n"  # What pixel is reserved for transparency
-        compressed_string += ".transparent_pixel_designator = " + transparent_pixel_designator + ",\n"  # What pixel is reserved for transparency
-        compressed_string += ".compressed = " + str(compress).lower() + ",\n"  # If the bitmap is compressed or not
-        compressed_string += ".pixel_data = {\n"
-
-        counter = 10  # Used for determining newlines on the outputted hex array
-        for index in range(0, pixel_data.size):
-            if pixel_data[index] > 0xF:  # If it's hex representation has 2 characters (eg 0xAA, 0x18)
-                compressed_string += f"0x{pixel_data[index]:X}"  # Print the hex value with capital letters
-            else:  # Else it's hex representation has only 1 characters (eg 0xA, 0x4) so a 0 will be added in front to maintain formatting
-                compressed_string += f"0x0{pixel_data[index]:X}"
-
-            if index != pixel_data.size - 1:  # Don't add a comma at the end of the array
-                compressed_string += ", "  # There is another byte following the current one so place a comma
-            else:  # We have reached the end of the file, place the closing sets of brackets and close the include guard
-                compressed_string += "},\n};\n#endif // " + file_name.upper() + "_HPP"
-            counter += 1
-
-            # Determines if a newline will be placed at the end, in this case it is placed every 10 bytes
-            if counter > 12 and counter % 10 == 0:
-                compressed_string += '\n'
-        return compressed_string
-
-    def _write_to_hpp(self, image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress):
-        outfile = open(str(file_path), "w")  # Open or create a header file to place the data into
-        outfile.write(
-            self._generate_output_string(image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress)
-        )  # Copy the data in
-        outfile.close()  # Save the file
+        template_arguments = str(pixel_data.size) + ("" if row_index is None else ", " + str(len(row_index)))  # The row index size is only given if there is one so other headers stay the same
+        outfile.write("#ifndef " + file_name.upper() + "_HPP" + "\n#define " + file_name.upper() + "_HPP\n")  # Include guard
+        outfile.write("#include \"Bitmap/Bitmap.hpp\"\n\n")  # Struct base defintion file
+        outfile.write("static const Bitmap<" + template_arguments + "> " + file_name + "{\n")  # Struct instance definition with template filled in
+        outfile.write(".width = " + str(image_width) + ",\n")  # Picture width
+        outfile.write(".height = " + str(image_height) + ",\n")  # Picture height
+        outfile.write(".size = " + str(pixel_data.size) + ",\n")  # Number of bytes in the pixel_data array
+        outfile.write(".transparency = " + str(transparency).lower() + ",\n")  # Whether or not the bitmap uses transparency
+        outfile.write(".transparent_pixel_designator = " + transparent_pixel_designator + ",\n")  # What pixel is reserved for transparency
+        outfile.write(".compressed = " + str(compress).lower() + ",\n")  # If the bitmap is compressed or not
+        outfile.write(".pixel_data = {\n")
+        # Plain ints are much faster to look up than numpy scalars
+        last_line_full = self._emit_array(outfile, numpy.asarray(pixel_data, dtype = numpy.uint8).ravel().tolist(), self._HEX_BYTES.__getitem__, bytes_per_line)
+        outfile.write("\n")
 
-    def _open_image(self, filepath):
-        input_image = Image.open(filepath, 'r')  # Open the image in read only mode
-        width, height = input_image.size  # Get the width and height of the picture
+        if row_index is not None:  # The byte that each tile of rows starts at in pixel_data, so decoding can start at any tile instead of the first byte
+            outfile.write(".rows_per_tile = " + str(rows_per_tile) + ",\n")
+            outfile.write(".row_index = {\n")
+            self._emit_array(outfile, numpy.asarray(row_index).ravel().tolist(), str, bytes_per_line)
+            outfile.write("\n")
+        if extended:  # Only written for the extended format so other headers stay the same
+            outfile.write(".extended = true,\n")
+
+        # Place the closing sets of brackets and close the include guard
+        outfile.write("};\n#endif // " + file_name.upper() + "_HPP" + ("\n" if last_line_full else ""))
 
-        self._pixel_data_2d = numpy.array(input_image)  # Get the data in a 2D representation
+    def _write_to_hpp(self, image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress, bytes_per_line = 10, row_index = None, rows_per_tile = 0,
+                      extended = False, stats = None):
+        if stats is None:  # Nobody asked for the timings, so they are just thrown away
+            stats = ConversionStats.ConversionStats()
+        if not os.path.exists(str(file_path)):  # There is nothing to compare against, so stream the header straight into the new file
+            with stats.stage("write"):  # The header is written as it is made, so making it is counted as part of writing it
+                with open(str(file_path), "w") as outfile:
+                    self._emit_output(outfile, image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress, bytes_per_line, row_index,
+                                      rows_per_tile, extended)
+            return True
+        with stats.stage("header"):
+            output_string = self._generate_output_string(image_width, image_height, pixel_data, file_path, transparency, transparent_pixel_designator, compress, bytes_per_line,
+                                                         row_index, rows_per_tile, extended)
+        with stats.stage("write"):
+            return self.write_header(file_path, output_string)
 
-        pixel_values = list(input_image.getdata())  # Convert the pixel data to a 1D list
-        pixel_values = numpy.array(pixel_values).reshape((width, height, 1))  # Create a numpy array with the x, y, and grayscale value (0-255)
+    # Only writes the header if its contents have changed, this keeps the file's timestamp the same so build tools like make and ninja do not rebuild anything that includes it.
+    # Returns whether it was written, this is also how a header generated with save = False (eg one taken from a cache) can be saved
+    def write_header(self, file_path, output_string):
+        try:
+            with open(str(file_path), "r") as existing_file:
+                if existing_file.read() == output_string:
+                    return False  # Nothing was written
+        except (OSError, UnicodeDecodeError):  # The file does not exist yet (or can't be read), so it will be written
+            pass
+        with open(str(file_path), "w") as outfile:  # Open or create a header file to place the data into
+            outfile.write(output_string)  # Copy the data in
+        return True
+
+    # Reads a 4 bit bitmap straight out of the mapped file, returning None for anything else (other bit depths, RLE4 compressed bitmaps, old header versions) so Pillow can read it instead
+    def _read_4bit_bmp(self, file_data):
+        if len(file_data) < 54 or file_data[:2] != b"BM":
+            return None
+        pixel_offset, = struct.unpack_from("<I", file_data, 10)  # Where the pixel rows start, after the headers and palette
+        header_size, image_width, image_height, _, bits_per_pixel, compression = struct.unpack_from("<IiiHHI", file_data, 14)
+        if header_size < 40 or bits_per_pixel != 4 or compression != 0 or image_width <= 0 or image_height == 0:
+            return None
+        row_count = abs(image_height)  # A negative height means the rows are stored top down
+        row_size = ((image_width + 1) // 2 + 3) & ~3  # Each row holds 2 pixels per byte and is padded to a multiple of 4 bytes
+        if pixel_offset + (row_size * row_count) > len(file_data):
+            return None
+
+        rows = numpy.frombuffer(file_data, dtype = numpy.uint8, count = row_size * row_count, offset = pixel_offset).reshape(row_count, row_size)  # A view of the file, nothing is copied yet
+        if image_height > 0:
+            rows = rows[::-1]  # Bottom up rows are flipped so the first row is the top of the image
+        # The palette index of each pixel is its gray level, so the nibbles are split apart into the only copy of the pixels that is kept, the padding is never read
+        pixel_data = numpy.empty((row_count, image_width), dtype = numpy.uint8)
+        pixel_data[:, 0::2] = rows[:, :(image_width + 1) // 2] >> 4
+        pixel_data[:, 1::2] = rows[:, :image_width // 2] & 0xF
+        return image_width, row_count, pixel_data.reshape(-1)
+
+    def _open_image(self, filepath):
+        with open(filepath, 'rb') as image_file:
+            if os.fstat(image_file.fileno()).st_size:  # An empty file can't be mapped, Pillow reports the error instead
+                with mmap.mmap(image_file.fileno(), 0, access = mmap.ACCESS_READ) as file_data:
+                    image = self._read_4bit_bmp(file_data)
+                if image is not None:
+                    return image
 
-        return width, height, pixel_values.flatten()  # Convert the 2D array to a 1D array
+        with Image.open(filepath, 'r') as input_image:  # Any other image is decoded once by Pillow, a palettized image gives its palette indexes
+            pixel_data = numpy.array(input_image, dtype = numpy.uint8)
+            return input_image.width, input_image.height, pixel_data.reshape(-1)  # Stored as a 1D array of rows, top row first
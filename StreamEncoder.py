@@ -0,0 +1,79 @@
+import numpy
+
+import RLE4Bit
+
+
+# Encodes an image a chunk of rows at a time, so images that are too tall to hold in memory (eg long scrolling images) or frames that are generated on the fly never have to be
+# loaded in full. All of the state lives on the instance, so any number of encoders can run at once, including on different threads
+class StreamEncoder:
+    def __init__(self, image_width, compress = True, transparent_pixel_designator = 0x1):
+        if image_width < 1:
+            raise ValueError(f"image_width must be at least 1, got {image_width}")
+        self.image_width = image_width
+        self.compress = compress
+        self.image_height = 0  # The number of rows encoded so far, which is the image's height once the encoder is flushed
+        self.size = 0  # The number of bytes of pixel data produced so far
+        self._compressor = RLE4Bit.RLE4Bit()  # Only used for its conversion methods, every encoder has its own so the settings below are never shared
+        self._compressor._image_width = image_width
+        self._compressor.change_transparent_pixel_designator(transparent_pixel_designator)
+        # The end of the last run of the previous chunk is held back as the next chunk might continue it, it is never more than 15 pixels as any full bytes are written straight away
+        self._pending_value = 0
+        self._pending_length = 0
+        self._flushed = False
+
+    # Encodes one row or a chunk of rows (anything numpy can turn into whole rows of 0000gggg values) and returns the bytes that are ready so far
+    def write(self, rows):
+        if self._flushed:
+            raise ValueError("Can't write to an encoder that has already been flushed")
+        pixel_data = numpy.asarray(rows).astype(numpy.uint8, copy = False).reshape(-1)
+        if pixel_data.size % self.image_width:
+            raise ValueError(f"Rows must be {self.image_width} pixels wide, got {pixel_data.size} pixels which is not a whole number of rows")
+        row_count = pixel_data.size // self.image_width
+        self.image_height += row_count
+
+        if not self.compress:  # Every row is packed on its own, so nothing has to be carried over to the next chunk
+            self._compressor._image_height = row_count
+            return self._output(self._compressor._uncompressed_convert(pixel_data))
+        if row_count == 0:
+            return b""
+
+        run_starts, run_values, run_lengths = self._compressor._find_runs(pixel_data)
+        if self._pending_length:
+            if run_values[0] == self._pending_value:  # The chunk starts by continuing the run that was held back
+                run_lengths[0] += self._pending_length
+            else:
+                run_values = numpy.concatenate(([self._pending_value], run_values)).astype(numpy.uint8)
+                run_lengths = numpy.concatenate(([self._pending_length], run_lengths))
+
+        # The full 15 pixel bytes of the last run can be written now, since a run is always split into 15s followed by the remainder no matter how long it ends up being
+        self._pending_value = int(run_values[-1])
+        self._pending_length = int((run_lengths[-1] - 1) % 15) + 1
+        run_lengths[-1] -= self._pending_length
+        if run_lengths[-1] == 0:  # Nothing of the last run is ready yet
+            run_values, run_lengths = run_values[:-1], run_lengths[:-1]
+        grayscale_values, sequential_pixels, _ = self._compressor._split_runs(run_values, run_lengths)
+        return self._output((grayscale_values << 4) | sequential_pixels)
+
+    # Returns whatever was held back, after this the encoder has produced exactly the same bytes as converting the whole image at once
+    def flush(self):
+        if self._flushed:
+            return b""
+        self._flushed = True
+        if not self._pending_length:
+            return b""
+        return self._output(numpy.array([(self._pending_value << 4) | self._pending_length]))
+
+    # Encodes every chunk from an iterable of rows or chunks of rows, yielding the encoded bytes as they are ready
+    def encode(self, chunks):
+        for rows in chunks:
+            data = self.write(rows)
+            if data:
+                yield data
+        data = self.flush()
+        if data:
+            yield data
+
+    def _output(self, pixel_data):
+        data = numpy.asarray(pixel_data).astype(numpy.uint8, copy = False).tobytes()
+        self.size += len(data)
+        return data
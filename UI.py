@@ -1,4 +1,8 @@
+import functools
+import os
 import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog
 from tkinter import scrolledtext, PhotoImage
 from tkinter import ttk as ttk
@@ -9,32 +13,50 @@ import RLE4Bit
 class UI:
     compressor = RLE4Bit.RLE4Bit()
     window = tk.Tk
+    _CACHED_HEADERS = 256  # How many converted headers are kept, so going back to settings that were already used shows the header without converting again
+    _POLL_MILLISECONDS = 20  # How often the Tk event loop checks whether the background job has finished
 
     def __init__(self):
         # Create the root window
         self.window = tk.Tk()
         self.window.title('Bitmap Compressor')
-        self.window.geometry("500x500")  # Set window size
+        self.window.geometry("500x530")  # Set window size
         self.filename = ""
+        self.file_version = None  # The modification time of the imported file, so a file that was edited and imported again is never shown from the cache
+        self.preview_pixels = None  # The unpacked pixels of the imported image, used to draw the preview
+        self.preview_canvas = None
+        self.preview_images = {}  # Transparent pixel designator (None without transparency) -> preview of the imported image, so changing back to a setting just swaps the image
+
+        # Loading and converting run one at a time on a worker thread so the window never freezes, it also means a compressor is never used by two jobs at once
+        self.executor = ThreadPoolExecutor(max_workers = 1)
+        self.running_jobs = 0
+        self.pending_conversion = None  # The last conversion that was asked for, cancelled if the settings change again before it starts
+        self.import_count = 0  # Incremented on every import so an image that finishes loading after a newer one was chosen is ignored
+        self.converted_headers = OrderedDict()  # (file, file version, transparency, designator, compress, extended) -> (header, stats summary), least recently used first
 
         self._generate_file_menu()
         self._generate_transparent_pixel_optionmenu()
         self._generate_transparent_pixel_checkbox()
         self._generate_data_size_labels()
         self._generate_compress_checkbox()
+        self._generate_extended_checkbox()
         self._generate_output_scolledtext()
+        self._generate_status_bar()
 
         self.window.mainloop()
+        self.executor.shutdown(wait = False, cancel_futures = True)  # Don't start anything that was still waiting once the window is closed
 
     def _import(self):
-        self._browse_files()
-        self._update_data_sizes()
-        self._update_pixel_output_text()
+        filename = filedialog.askopenfilename(initialdir = "/Quick access", title = "Select a 4 Bit BMP Image", filetypes = (("Bitmap files", "*.bmp*"), ("all files", "*.*")))
+        if not filename:
+            return
+        self.import_count += 1
+        self._run_in_background(functools.partial(self._image_loaded, filename, self.import_count), self._load_image, filename)
 
     def _generate_transparent_pixel_optionmenu(self):
         # Create the transparent pixel designator selector
         transparent_pixel_designator_label = tk.Label(self.window, text = "Transparent Pixel Designator:")
-        transparent_pixel_designator_label.grid(row = 2, column = 0, sticky = tk.W)
+        transparent_pixel_designator_label.grid(row = 3, column = 0, sticky = tk.W)
 
         # Thanks: https://stackoverflow.com/questions/45441885/how-can-i-create-a-dropdown-menu-from-a-list-in-tkinter
         transparent_pixel_options = ["0x0", "0x1", "0x2", "0x3", "0x4", "0x5", "0x6", "0x7", "0x8", "0x9", "0xA", "0xB", "0xC", "0xD", "0xE", "0xF"]
@@ -42,97 +64,179 @@ class UI:
         self.transparent_pixel_designator_value.set(transparent_pixel_options[0])  # Set the string to be equal to the name that is chosen in the list TODO: Read this value from the INI file
         transparent_pixel_designator_combobox = tk.ttk.Combobox(self.window, textvariable = self.transparent_pixel_designator_value, values = transparent_pixel_options,
                                                                 width = 4)  # Set up the optionmenu with the initial value and list of values
-        transparent_pixel_designator_combobox.grid(row = 2, column = 1, sticky = tk.W)  # Add it to the grid next to the transparent pixel label
+        transparent_pixel_designator_combobox.grid(row = 3, column = 1, sticky = tk.W)  # Add it to the grid next to the transparent pixel label
         transparent_pixel_designator_combobox.bind("<<ComboboxSelected>>", self._update_pixel_output_text)  # Thanks: https://stackoverflow.com/questions/35209522/how-to-make-a-ttk-combobox-callback
 
     def _generate_transparent_pixel_checkbox(self):
         self.transparency_checkbox_var = tk.BooleanVar()
         self.transparency_checkbox = tk.Checkbutton(self.window, text = "Transparency", variable = self.transparency_checkbox_var, onvalue = True, offvalue = False, command = self._update_pixel_output_text)
-        self.transparency_checkbox.grid(row = 3, column = 0, sticky = tk.W)
+        self.transparency_checkbox.grid(row = 4, column = 0, sticky = tk.W)
 
     def _generate_compress_checkbox(self):
         self.compress_checkbox_var = tk.BooleanVar()
         self.compress_checkbox = tk.Checkbutton(self.window, text = "Compress", variable = self.compress_checkbox_var, onvalue = True, offvalue = False, command = self._update_pixel_output_text)
-        self.compress_checkbox.grid(row = 3, column = 1, sticky = tk.W)
+        self.compress_checkbox.grid(row = 4, column = 1, sticky = tk.W)
+
+    def _generate_extended_checkbox(self):
+        self.extended_checkbox_var = tk.BooleanVar()
+        self.extended_checkbox = tk.Checkbutton(self.window, text = "Extended", variable = self.extended_checkbox_var, onvalue = True, offvalue = False, command = self._update_pixel_output_text)
+        self.extended_checkbox.grid(row = 5, column = 1, sticky = tk.W)
 
     def _generate_data_size_labels(self):
         self.uncompressed_size = tk.IntVar()  # Will be updated whenever an image is imported with the size of the image if compression is not chosen
         self.compressed_size = tk.IntVar()  # Will be updated whenever an image is imported with the size of the image if compression is chosen
+        self.extended_size = tk.IntVar()  # Will be updated whenever an image is imported with the size of the image if extended compression is chosen
         uncompress_size_label = tk.Label(self.window, text = "Uncompressed Size (Bytes): ")
         uncompress_size_data_label = tk.Label(self.window, textvariable = self.uncompressed_size)  # Bind the uncompressed_size variable to this label
         compress_size_label = tk.Label(self.window, text = "Compressed Size (Bytes): ")
         compress_size_data_label = tk.Label(self.window, textvariable = self.compressed_size)  # Bind the compressed_size variable to this label
+        extended_size_label = tk.Label(self.window, text = "Extended Size (Bytes): ")
+        extended_size_data_label = tk.Label(self.window, textvariable = self.extended_size)  # Bind the extended_size variable to this label
 
         # Add each of the elements to the grid in the form Label: Size
         uncompress_size_label.grid(row = 0, column = 0, sticky = tk.W)
         uncompress_size_data_label.grid(row = 0, column = 1, sticky = tk.W)
         compress_size_label.grid(row = 1, column = 0, sticky = tk.W)
         compress_size_data_label.grid(row = 1, column = 1, sticky = tk.W)
+        extended_size_label.grid(row = 2, column = 0, sticky = tk.W)
+        extended_size_data_label.grid(row = 2, column = 1, sticky = tk.W)
 
     def _generate_output_scolledtext(self):
         self.output_scolledtext = scrolledtext.ScrolledText(self.window, wrap = tk.WORD, width = 60, height = 20)
-        self.output_scolledtext.grid(row = 5, column = 0, sticky = tk.SW, columnspan = 4)
+        self.output_scolledtext.grid(row = 6, column = 0, sticky = tk.SW, columnspan = 4)
 
-    def _browse_files(self):
-        filename = filedialog.askopenfilename(initialdir = "/Quick access", title = "Select a 4 Bit BMP Image", filetypes = (("Bitmap files", "*.bmp*"), ("all files", "*.*")))
-        if not filename:
+    def _generate_status_bar(self):
+        self.status_text = tk.StringVar(self.window, "Import a bitmap to convert it")
+        status_label = tk.Label(self.window, textvariable = self.status_text)
+        status_label.grid(row = 7, column = 0, sticky = tk.W, columnspan = 2)
+        self.progress_bar = ttk.Progressbar(self.window, mode = "indeterminate", length = 100)  # Bounces back and forth while a job is running as there is no way to know how far along a conversion is
+        self.progress_bar.grid(row = 7, column = 2, sticky = tk.E, padx = 5)
+
+    # Runs function on the worker thread and calls on_done with its result back on the Tk thread, as Tk must only be used from the thread running mainloop
+    def _run_in_background(self, on_done, function, *args):
+        future = self.executor.submit(function, *args)
+        self.running_jobs += 1
+        self._update_status()
+        self.window.after(self._POLL_MILLISECONDS, self._check_job, future, on_done)
+        return future
+
+    def _check_job(self, future, on_done):
+        if not future.done():
+            self.window.after(self._POLL_MILLISECONDS, self._check_job, future, on_done)
+            return
+        self.running_jobs -= 1
+        self._update_status()
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as error:  # Show the problem (eg a file that isn't a bitmap) instead of losing it on the worker thread
+            self.status_text.set(f"Failed: {error}")
+            return
+        on_done(result)
+
+    def _update_status(self):
+        if self.running_jobs:
+            self.status_text.set("Converting...")
+            self.progress_bar.start()
+        else:
+            self.status_text.set("Ready")
+            self.progress_bar.stop()
+
+    # Runs on the worker thread, everything shown about a newly imported image is worked out here so importing a large bitmap doesn't block the window
+    @staticmethod
+    def _load_image(filename):
+        compressor = RLE4Bit.RLE4Bit()  # Each image gets its own compressor, so a conversion of the previous image that is still running keeps its own data
+        compressor.open_image(filename)
+        sizes = (compressor.uncompressed_size(), compressor.compressed_size(), compressor.extended_compressed_size())
+        # Unpack the data as it will be stored once per import, so changing a setting only has to recolor the preview
+        preview_pixels = compressor._uncompressed_decode(compressor.uncompressed_pixel_data(), compressor._image_width, compressor._image_height)
+        return compressor, os.stat(filename).st_mtime_ns, sizes, compressor.smallest_format(), preview_pixels
+
+    def _image_loaded(self, filename, import_number, result):
+        if import_number != self.import_count:  # Another image was chosen while this one was loading
             return
-        self.compressor.open_image(filename)  # Load the pixel data into the RLE object
-        self._display_image()
+        self.compressor, self.file_version, sizes, smallest_format, self.preview_pixels = result
         self.filename = filename
+        self.preview_images = {}
+        self.uncompressed_size.set(sizes[0])
+        self.compressed_size.set(sizes[1])
+        self.extended_size.set(sizes[2])
+
+        # Select the checkboxes for whichever format stores the image in the fewest bytes, a compressed format is only picked if it is smaller
+        self.compress_checkbox_var.set(smallest_format != "uncompressed")
+        self.extended_checkbox_var.set(smallest_format == "extended")
+        self._update_pixel_output_text()
+
+    # Runs on the worker thread, the designator is set here rather than by the UI as the worker is the only thread that uses the compressor
+    @staticmethod
+    def _convert(compressor, filepath, has_transparency, transparent_pixel_designator, compress, extended, save):
+        compressor.change_transparent_pixel_designator(int(transparent_pixel_designator, 16))
+        return compressor.convert_image(filepath = filepath,
+                                        has_transparency = has_transparency,
+                                        transparent_pixel_designator = transparent_pixel_designator,
+                                        compress = compress,
+                                        save = save,
+                                        extended = extended,
+                                        return_stats = True)  # Returns (header or whether it was written, stats)
+
+    # A short summary of a conversion's stats for the status bar
+    @staticmethod
+    def _describe_stats(stats):
+        return f"{stats.data_format}, {stats.bytes['pixel_data']} bytes ({stats.ratio():.2f}x smaller), converted in {sum(stats.seconds.values()) * 1000:.1f} ms"
+
+    # Everything the generated header depends on
+    def _conversion_key(self):
+        return (self.filename, self.file_version, self.transparency_checkbox_var.get(), self.transparent_pixel_designator_value.get(), self.compress_checkbox_var.get(),
+                self.extended_checkbox_var.get())
 
     def _update_pixel_output_text(self, event = 0):
         if not self.filename:
             return
-        self.compressor.change_transparent_pixel_designator(int(self.transparent_pixel_designator_value.get(), 16))
+        self._display_image()  # Recoloring the preview is cheap, so it follows the settings straight away
+        if self.pending_conversion is not None:
+            self.pending_conversion.cancel()  # This only stops a conversion that hasn't started, one that is already running is cached when it finishes but not shown
+
+        key = self._conversion_key()
+        if key in self.converted_headers:
+            self.converted_headers.move_to_end(key)
+            self._show_header(*self.converted_headers[key])
+            return
+        self.pending_conversion = self._run_in_background(functools.partial(self._header_converted, key), self._convert, self.compressor, self.filename, *key[2:], False)
+
+    def _header_converted(self, key, result):
+        header, stats = result
+        self.converted_headers[key] = (header, self._describe_stats(stats))
+        while len(self.converted_headers) > self._CACHED_HEADERS:
+            self.converted_headers.popitem(last = False)
+        if key == self._conversion_key():  # Only show it if the settings haven't been changed since it was asked for
+            self._show_header(*self.converted_headers[key])
+
+    def _show_header(self, header, description):
         self.output_scolledtext.delete('1.0', tk.END)
-        self.output_scolledtext.insert('1.0', self.compressor.convert_image(filepath = self.filename,
-                                                                            has_transparency = self.transparency_checkbox_var.get(),
-                                                                            transparent_pixel_designator = self.transparent_pixel_designator_value.get(),
-                                                                            compress = self.compress_checkbox_var.get(),
-                                                                            save = False))
-        self._display_image()
-
-    def _update_data_sizes(self):
-        self.uncompressed_size.set(self.compressor.uncompressed_size())
-        self.compressed_size.set(self.compressor.compressed_size())
-
-        # If the image is smaller compressed, set the compression checkbox to selected
-        if self.compressed_size.get() < self.uncompressed_size.get():
-            self.compress_checkbox_var.set(True)
-        else:  # Otherwise since the data is smaller uncompressed, uncheck the box
-            self.compress_checkbox_var.set(False)
+        self.output_scolledtext.insert('1.0', header)
+        if not self.running_jobs:  # Don't hide that a newer conversion is still running
+            self.status_text.set(description)
 
     def _display_image(self):
-        canvas = tk.Canvas(self.window, width = 128, height = 128, bg = "#000000")
-        canvas.grid(row = 0, column = 2, sticky = tk.E, rowspan = 4, columnspan = 1, padx = 5)
-        img = PhotoImage(width = 128, height = 128)
-        self.window.img = img  # Prevent garbage collection
-        canvas.create_image(128 / 2, 128 / 2, image = img, state = "normal")
-
-        pixel_data = self.compressor.uncompressed_pixel_data()
-        array_index = 0
-
-        print(pixel_data.size)
-
-        # Thanks: https://stackoverflow.com/questions/12284311/python-tkinter-how-to-work-with-pixels/12287117
-        def _pixel(x, y, color):
-            img.put(("#" + f"{color:X}" * 3), (x, y))
-
-        for y in range(3, self.compressor._image_height + 3):
-            # If the bitmap is an odd width, it must be draw like it was an even width bitmap so add 1 to the range for x to change it to an even number of columns
-            for x in range(self.compressor._image_width + (self.compressor._image_width % 2)):
-                if not x % 2 == 1:  # If it is an even pixel
-                    grayscale = pixel_data[array_index] >> 4  # The data is stored in the upper 4 bits of the byte
-                else:  # It is an odd pixel
-                    grayscale = pixel_data[array_index] & 0b1111  # The data is stored in the lower 4 bits
-                    array_index = array_index + 1  # Increment the index of the array being read in only when odd pixels are processed because there are 2 pixels per byte
-
-                # If the image has transparency enabled and the current pixel being draw is the value of the transparent pixel designator
-                if self.transparency_checkbox_var.get() and grayscale == int(self.transparent_pixel_designator_value.get(), 16):
-                    img.put("#FF0000", (x, y))  # Draw the pixel in a different color to indicate that it will be transparent
-                else:  # Otherwise if there is no transparency or the pixel is not the same value as the TPD
-                    _pixel(x, y, grayscale)  # Draw it as normal
+        if self.preview_pixels is None:
+            return
+        if self.preview_canvas is None:  # The canvas is only made once and then resized to fit each image
+            self.preview_canvas = tk.Canvas(self.window, width = 128, height = 128, bg = "#000000", highlightthickness = 0)
+            self.preview_canvas.grid(row = 0, column = 2, sticky = tk.NE, rowspan = 6, columnspan = 1, padx = 5)
+
+        # If the image has transparency enabled, the pixels with the same value as the transparent pixel designator are drawn in red to indicate that they will be transparent
+        transparent_pixel_designator = int(self.transparent_pixel_designator_value.get(), 16) if self.transparency_checkbox_var.get() else None
+        image_width, image_height = self.compressor._image_width, self.compressor._image_height
+        img = self.preview_images.get(transparent_pixel_designator)
+        if img is None:
+            # The whole image is handed to Tk as PPM data in one call instead of setting each pixel
+            img = PhotoImage(width = image_width, height = image_height, format = "PPM",
+                             data = self.compressor._preview_ppm(self.preview_pixels, image_width, image_height, transparent_pixel_designator))
+            self.preview_images[transparent_pixel_designator] = img  # Also keeps a reference so Tk doesn't lose the image to garbage collection
+        self.preview_canvas.config(width = image_width, height = image_height)
+        self.preview_canvas.delete("all")
+        self.preview_canvas.create_image(0, 0, image = img, anchor = tk.NW, state = "normal")
 
     def _generate_file_menu(self):
         menubar = tk.Menu(self.window)
@@ -158,8 +262,8 @@ class UI:
         if not filepath:
             return
 
-        self.compressor.convert_image(filepath = filepath,
-                                      has_transparency = self.transparency_checkbox_var.get(),
-                                      transparent_pixel_designator = self.transparent_pixel_designator_value.get(),
-                                      compress = self.compress_checkbox_var.get(),
-                                      save = True)
+        if not self.filename:
+            return
+
+        # The header's name comes from the file it is saved to, so it can't be taken from the cache and is converted again on the worker thread
+        self._run_in_background(lambda result: self.status_text.set(f"Saved {filepath}: {self._describe_stats(result[1])}"), self._convert, self.compressor, filepath, *self._conversion_key()[2:], True)
@@ -0,0 +1,271 @@
+import argparse
+import glob
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import BuildCache
+import ConversionStats
+import RLE4Bit  # Only the converter is imported (never UI) so this runs on machines without tkinter or a display
+
+_BITMAP_EXTENSIONS = (".bmp",)
+
+
+# Expands every directory and glob pattern given on the command line into a sorted list of bitmap files with no duplicates
+def find_bitmaps(paths, recursive = False):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for directory, _, filenames in os.walk(path):
+                    found.extend(os.path.join(directory, filename) for filename in filenames if filename.lower().endswith(_BITMAP_EXTENSIONS))
+            else:
+                found.extend(os.path.join(path, filename) for filename in os.listdir(path) if filename.lower().endswith(_BITMAP_EXTENSIONS))
+        else:  # Anything else is treated as a glob pattern, which also covers a plain file path
+            found.extend(match for match in glob.glob(path, recursive = recursive) if os.path.isfile(match))
+    return sorted(set(os.path.normpath(path) for path in found))
+
+
+# The header is named after the bitmap and goes in the output directory if one was given, otherwise it is placed next to the bitmap
+def output_path_for(source_path, output_directory = None):
+    file_name = os.path.splitext(os.path.basename(source_path))[0] + ".hpp"
+    return os.path.join(output_directory if output_directory else os.path.dirname(source_path), file_name)
+
+
+# Runs in a worker process, so everything it needs is passed in and everything it reports is returned as plain values that can be pickled.
+# If collect_stats is set the result also holds the ConversionStats of the file as a dict, and if profile_directory is given a cProfile of the file is saved there
+def convert_file(source_path, output_path, has_transparency, transparent_pixel_designator, mode, cache_directory = None, bytes_per_line = 10, rows_per_tile = 0, collect_stats = False,
+                 profile_directory = None):
+    start_time = time.perf_counter()
+    stats = ConversionStats.ConversionStats(source = source_path, output = output_path)
+    with ConversionStats.profile(os.path.splitext(os.path.basename(source_path))[0], profile_directory):
+        compressor = RLE4Bit.RLE4Bit()
+        with stats.stage("load"):
+            compressor.open_image(source_path)
+        compressor.change_transparent_pixel_designator(transparent_pixel_designator)
+
+        key = None
+        entry = None
+        if cache_directory:  # Look the result up by the hash of the pixels and settings, only the cheap image load and hash happen on a hit
+            with stats.stage("cache"):
+                file_name = os.path.basename(output_path).partition('.')[0]  # The header's name is part of its contents, so it is part of the key
+                key = BuildCache.cache_key(compressor._pixel_data, compressor._image_width, compressor._image_height, file_name, has_transparency, transparent_pixel_designator, mode,
+                                             bytes_per_line, rows_per_tile)
+                entry = BuildCache.load_entry(cache_directory, key)
+        cached = entry is not None
+
+        if cached:  # Nothing is converted, so the stats of the conversion that made the header are taken from the cache
+            stats.image_width, stats.image_height = compressor._image_width, compressor._image_height
+            stats.data_format = entry["format"]
+            stats.bytes.update(entry.get("sizes", {}))
+            stats.run_lengths = entry.get("run_lengths")
+        else:
+            # The same conversion as the UI, with the format picked (or forced) by mode. With a row index auto only compares the row indexed format (including its index) to uncompressed
+            output = compressor.convert_image(filepath = output_path, has_transparency = has_transparency, transparent_pixel_designator = transparent_pixel_designator, save = False,
+                                              bytes_per_line = bytes_per_line, rows_per_tile = rows_per_tile, data_format = mode, stats = stats)
+            entry = {
+                "output": output,
+                "format": stats.data_format,
+                "bytes": stats.bytes["pixel_data"] + stats.bytes.get("row_index", 0),
+                "uncompressed_bytes": stats.bytes["uncompressed"],
+                "row_index_overhead": compressor.row_index_overhead(rows_per_tile) if "row_index" in stats.bytes else 0,
+                "sizes": dict(stats.bytes),
+                "run_lengths": stats.run_lengths,
+            }
+
+        with stats.stage("write"):
+            written = compressor.write_header(output_path, entry["output"])  # Headers with unchanged contents are left alone so their timestamps stay the same
+
+    return {
+        "source": source_path,
+        "output": output_path,
+        "format": entry["format"],
+        "compressed": entry["format"] != "uncompressed",
+        "bytes": entry["bytes"],
+        "uncompressed_bytes": entry["uncompressed_bytes"],
+        "row_index_overhead": entry.get("row_index_overhead", 0),
+        "seconds": time.perf_counter() - start_time,
+        "written": written,
+        "cached": cached,
+        "key": key,
+        "entry": entry,
+        "stats": stats.as_dict() if collect_stats else None,
+    }
+
+
+# Runs in a worker process when packing an atlas, only encodes the bitmap as the header is written once all of them are done
+def encode_file(source_path, transparent_pixel_designator, mode):
+    compressor = RLE4Bit.RLE4Bit()
+    compressor.open_image(source_path)
+    compressor.change_transparent_pixel_designator(transparent_pixel_designator)
+    data_format = compressor.smallest_format() if mode == "auto" else mode
+    name = os.path.basename(source_path).partition('.')[0]
+    return name, compressor._image_width, compressor._image_height, data_format, compressor._convert_format(data_format)
+
+
+# Packs every bitmap into a single atlas header instead of one header per bitmap
+def _convert_atlas(arguments, bitmaps):
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers = min(arguments.workers, len(bitmaps))) as executor:
+        encoded_images = list(executor.map(encode_file, bitmaps, [arguments.designator] * len(bitmaps), [arguments.mode] * len(bitmaps)))  # map keeps the bitmaps in order
+
+    compressor = RLE4Bit.RLE4Bit()
+    pixel_data, entries = compressor._pack_atlas(encoded_images)
+    output_path = os.path.join(arguments.output, arguments.atlas) if arguments.output else arguments.atlas
+    output_string = io.StringIO()
+    compressor._emit_atlas_output(output_string, pixel_data, entries, output_path, arguments.transparency, arguments.designator, arguments.bytes_per_line)
+    written = compressor.write_header(output_path, output_string.getvalue())
+
+    for bitmap, entry, encoded_image in zip(bitmaps, entries, encoded_images):
+        print(f"{bitmap} -> {entry['name']}: {encoded_image[3]}, {entry['size']} bytes at offset {entry['offset']}")
+    print(f"Packed {len(bitmaps)} bitmaps into {output_path} in {time.perf_counter() - start_time:.2f} s: {pixel_data.size} bytes of pixel data "
+          f"({sum(entry['size'] for entry in entries)} bytes before removing duplicates){'' if written else ', header unchanged'}")
+    return 0
+
+
+# Sorts frame files by the numbers in their names, so frame_2.bmp comes before frame_10.bmp
+def _frame_sort_key(path):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", os.path.basename(path))]
+
+
+# Packs the frames of an animation (one animated GIF, or numbered bitmaps) into a single header, each frame only storing what changed since the one before it where that is smaller
+def _convert_animation(arguments, paths):
+    start_time = time.perf_counter()
+    compressor = RLE4Bit.RLE4Bit()
+    compressor.change_transparent_pixel_designator(arguments.designator)
+    output_path = os.path.join(arguments.output, arguments.animation) if arguments.output else arguments.animation
+    try:  # Every frame depends on the one before it, so they are encoded in order in this process
+        written, stats = compressor.convert_animation(sorted(paths, key = _frame_sort_key), output_path, arguments.transparency, arguments.designator,
+                                                      bytes_per_line = arguments.bytes_per_line, return_stats = True)
+    except (OSError, ValueError) as error:  # Frames that aren't the same size or can't be read are reported the same way as a file that failed to convert
+        print(f"FAILED {output_path}: {error}", file = sys.stderr)
+        return 1
+
+    for frame_size in stats.entries:
+        delta = "" if frame_size["delta_bytes"] is None else f", delta {frame_size['delta_bytes']}"
+        print(f"Frame {frame_size['frame']}: {frame_size['format']}, {frame_size['bytes']} bytes (keyframe {frame_size['keyframe_bytes']}{delta})")
+    print(f"Packed {len(stats.entries)} frames into {output_path} in {time.perf_counter() - start_time:.2f} s: {stats.bytes['pixel_data']} bytes of pixel data "
+          f"({stats.bytes['keyframes_only']} bytes as keyframes only){'' if written else ', header unchanged'}")
+    return 0
+
+
+# One line summary of a converted file for the progress output
+def _describe_result(result):
+    description = f"{result['source']} -> {result['output']}: {result['format']}, {result['bytes']} bytes"
+    if result["row_index_overhead"]:
+        description += f" (the row index adds {result['row_index_overhead']})"
+    description += f", {result['seconds'] * 1000:.1f} ms"
+    if result["cached"]:
+        description += " (cached)"
+    if not result["written"]:
+        description += " (unchanged)"
+    return description
+
+
+def _parse_designator(value):
+    designator = int(value, 0) if value.lower().startswith("0x") else int(value, 16)  # Accept both 0xA and A, the same as the UI's drop down values
+    if not 0x0 <= designator <= 0xF:
+        raise argparse.ArgumentTypeError("transparent pixel designator must be between 0x0 and 0xF")
+    return designator
+
+
+def _parse_arguments(argv):
+    parser = argparse.ArgumentParser(description = "Convert 4 bit grayscale bitmaps into C++ headers without the GUI")
+    parser.add_argument("paths", nargs = "+", help = "Bitmap files, directories, or glob patterns to convert")
+    parser.add_argument("-o", "--output", help = "Directory to write the headers to (defaults to next to each bitmap)")
+    parser.add_argument("-j", "--workers", type = int, default = os.cpu_count(), help = "Number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("-r", "--recursive", action = "store_true", help = "Search directories and ** glob patterns recursively")
+    parser.add_argument("-t", "--transparency", action = "store_true", help = "Mark the bitmaps as using transparency")
+    parser.add_argument("-d", "--designator", type = _parse_designator, default = 0x0, help = "Transparent pixel designator, 0x0-0xF (default 0x0)")
+    parser.add_argument("-m", "--mode", choices = ("auto", "uncompressed", "compressed", "extended"), default = "auto",
+                        help = "How to store the pixel data, auto picks whichever format is smallest per file (default auto)")
+    parser.add_argument("-c", "--cache", help = "Directory of a persistent cache used to skip converting bitmaps that have not changed")
+    parser.add_argument("--cache-size", type = float, default = 64, help = "Maximum size of the cache in MiB before the least recently used entries are removed (default 64)")
+    parser.add_argument("--bytes-per-line", type = int, default = 10, help = "Number of pixel data bytes on each line of the header (default 10)")
+    parser.add_argument("--rows-per-tile", type = int, default = 0,
+                        help = "Break compressed runs every this many rows and add a row index so the bitmap can be decoded from any tile (default 0, no index)")
+    parser.add_argument("-a", "--atlas", help = "Pack every bitmap into this one header with shared, deduplicated pixel data instead of a header per bitmap (the cache is not used)")
+    parser.add_argument("--stats", help = "Append a line of JSON with the stage timings, byte counts, compression ratio and run length histogram of every converted file to this file "
+                                          "(- for standard output)")
+    parser.add_argument("--profile", help = "Save a cProfile of every converted file to this directory, which can be opened with pstats or snakeviz")
+    parser.add_argument("-A", "--animation", help = "Pack the frames of an animated GIF, or numbered bitmaps in order, into this one header with each frame stored as a delta against the one "
+                                                    "before it when that is smaller (the cache is not used)")
+    arguments = parser.parse_args(argv)
+    if arguments.workers < 1:
+        parser.error("--workers must be at least 1")
+    if arguments.bytes_per_line < 1:
+        parser.error("--bytes-per-line must be at least 1")
+    if not 0 <= arguments.rows_per_tile <= 255:
+        parser.error("--rows-per-tile must be between 0 and 255")
+    if arguments.atlas and arguments.animation:
+        parser.error("--atlas and --animation can't be used together")
+    if (arguments.atlas or arguments.animation) and (arguments.stats or arguments.profile):
+        parser.error("--stats and --profile are only for converting a header per bitmap")
+    return arguments
+
+
+def main(argv = None):
+    arguments = _parse_arguments(argv)
+    bitmaps = find_bitmaps(arguments.paths, arguments.recursive)
+    if not bitmaps:
+        print("No bitmaps found", file = sys.stderr)
+        return 1
+    if arguments.output:
+        os.makedirs(arguments.output, exist_ok = True)
+    if arguments.atlas:
+        return _convert_atlas(arguments, bitmaps)
+    if arguments.animation:
+        return _convert_animation(arguments, bitmaps)
+
+    cache = BuildCache.BuildCache(arguments.cache, max_bytes = int(arguments.cache_size * 1024 * 1024)) if arguments.cache else None
+
+    start_time = time.perf_counter()
+    results = []
+    failures = 0
+    stats_file = None
+    if arguments.stats:  # Only this process writes to the log, so the lines from different workers never get mixed together
+        stats_file = sys.stdout if arguments.stats == "-" else open(arguments.stats, "a")
+    try:
+        with ProcessPoolExecutor(max_workers = min(arguments.workers, len(bitmaps))) as executor:
+            futures = {executor.submit(convert_file, bitmap, output_path_for(bitmap, arguments.output), arguments.transparency, arguments.designator, arguments.mode,
+                                       arguments.cache, arguments.bytes_per_line, arguments.rows_per_tile, stats_file is not None, arguments.profile): bitmap
+                       for bitmap in bitmaps}
+            for future in as_completed(futures):  # Report each file as soon as it finishes rather than waiting for the whole batch
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failures += 1
+                    print(f"FAILED {futures[future]}: {error}", file = sys.stderr)
+                    continue
+                results.append(result)
+                print(_describe_result(result))
+                if stats_file is not None:
+                    stats_file.write(json.dumps(dict(result["stats"], cached = result["cached"], written = result["written"])) + "\n")
+    finally:
+        if stats_file is not None and stats_file is not sys.stdout:
+            stats_file.close()
+
+    if cache is not None:  # The workers only read from the cache, all the bookkeeping and writes happen here once they are done so nothing is evicted while a worker is reading it
+        for result in results:
+            cache.record(result["key"], hit = result["cached"])
+            if result["key"] not in cache:
+                cache.put(result["key"], result["entry"])
+        cache.save()
+
+    total_bytes = sum(result["bytes"] for result in results)
+    total_uncompressed_bytes = sum(result["uncompressed_bytes"] for result in results)
+    print(f"Converted {len(results)} of {len(bitmaps)} bitmaps in {time.perf_counter() - start_time:.2f} s: "
+          f"{total_bytes} bytes of pixel data ({total_uncompressed_bytes} bytes uncompressed), {sum(result['written'] for result in results)} headers written")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['evictions']} evictions, "
+              f"{stats['entries']} entries using {stats['stored_bytes']} bytes")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
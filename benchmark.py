@@ -0,0 +1,250 @@
+import argparse
+import io
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy
+from PIL import Image, ImageDraw
+
+import RLE4Bit
+import StreamEncoder
+
+_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+_ROWS_PER_TILE = 8  # The tile size used when measuring the row indexed format
+_STREAM_ROWS = 5  # The number of rows given to the streaming encoder at a time, which doesn't line up with the runs so the pending run is carried across chunks
+_STAGES = ("open", "pack", "rle", "extended", "row_index", "delta", "stream", "header", "preview")
+
+
+# Writes pixels as a 4 bit palettized bitmap with 16 gray levels, the same kind of file the README describes saving from an image editor
+def write_4bit_bmp(file_path, pixels):
+    image_height, image_width = pixels.shape
+    row_size = ((image_width + 1) // 2 + 3) & ~3  # Each row holds 2 pixels per byte and is padded to a multiple of 4 bytes
+    padded = numpy.zeros((image_height, row_size * 2), dtype = numpy.uint8)
+    padded[:, :image_width] = pixels
+    rows = (padded[:, 0::2] << 4) | padded[:, 1::2]
+    palette = b"".join(bytes((level * 17, level * 17, level * 17, 0)) for level in range(16))
+    pixel_offset = 14 + 40 + len(palette)
+    with open(file_path, "wb") as bmp_file:
+        bmp_file.write(struct.pack("<2sIHHI", b"BM", pixel_offset + rows.size, 0, 0, pixel_offset))  # File header
+        bmp_file.write(struct.pack("<IiiHHIIiiII", 40, image_width, image_height, 1, 4, 0, rows.size, 3937, 3937, 16, 0))  # Info header, a positive height means bottom up rows
+        bmp_file.write(palette)
+        bmp_file.write(rows[::-1].tobytes())
+
+
+def _gradient(image_width, image_height, seed):
+    return numpy.tile((numpy.arange(image_width) * 16 // image_width).astype(numpy.uint8), (image_height, 1))
+
+
+def _noise(image_width, image_height, seed):
+    return numpy.random.default_rng(seed).integers(0, 16, (image_height, image_width), dtype = numpy.uint8)
+
+
+def _sparse_noise(image_width, image_height, seed):  # A flat background with a few scattered pixels, like an icon with some detail
+    random = numpy.random.default_rng(seed)
+    pixels = numpy.zeros((image_height, image_width), dtype = numpy.uint8)
+    mask = random.random((image_height, image_width)) < 0.05
+    pixels[mask] = random.integers(1, 16, mask.sum())
+    return pixels
+
+
+def _text(image_width, image_height, seed):
+    image = Image.new("L", (image_width, image_height), 0)
+    draw = ImageDraw.Draw(image)
+    for line, y in enumerate(range(0, image_height, 12)):
+        draw.text((2, y), f"Line {line}: The quick brown fox 0123456789 " * (image_width // 200 + 1), fill = 255)
+    return (numpy.asarray(image) >> 4).astype(numpy.uint8)
+
+
+def _flat(image_width, image_height, seed):
+    return numpy.full((image_height, image_width), 0x7, dtype = numpy.uint8)
+
+
+# Each synthetic image is (name, generator, width, height)
+_IMAGES = [
+    ("gradient_128x128", _gradient, 128, 128),
+    ("noise_128x128", _noise, 128, 128),
+    ("sparse_noise_128x128", _sparse_noise, 128, 128),
+    ("text_128x128", _text, 128, 128),
+    ("flat_128x128", _flat, 128, 128),
+    ("gradient_odd_127x33", _gradient, 127, 33),
+    ("noise_odd_21x17", _noise, 21, 17),
+    ("text_odd_255x63", _text, 255, 63),
+    ("flat_1x1", _flat, 1, 1),
+    ("gradient_320x240", _gradient, 320, 240),
+    ("gradient_1024x1024", _gradient, 1024, 1024),
+    ("noise_1024x1024", _noise, 1024, 1024),
+    ("sparse_noise_1024x1024", _sparse_noise, 1024, 1024),
+    ("text_1024x1024", _text, 1024, 1024),
+    ("flat_1024x1024", _flat, 1024, 1024),
+]
+
+
+# Runs function repeat times and returns its result along with the fastest time, the fastest run is the one least affected by anything else happening on the machine
+def _time(function, repeat):
+    best_time = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return result, best_time
+
+
+def benchmark_image(name, pixels, directory, repeat):
+    image_height, image_width = pixels.shape
+    file_path = os.path.join(directory, name + ".bmp")
+    write_4bit_bmp(file_path, pixels)
+    compressor = RLE4Bit.RLE4Bit()
+
+    seconds = {}
+    (compressor._image_width, compressor._image_height, compressor._pixel_data), seconds["open"] = _time(lambda: compressor._open_image(file_path), repeat)
+    uncompressed, seconds["pack"] = _time(lambda: compressor._uncompressed_convert(compressor._pixel_data), repeat)
+    compressed, seconds["rle"] = _time(lambda: compressor._compressed_convert(compressor._pixel_data), repeat)
+    extended, seconds["extended"] = _time(lambda: compressor._extended_compressed_convert(compressor._pixel_data), repeat)
+    (row_compressed, row_index), seconds["row_index"] = _time(lambda: compressor._row_compressed_convert(compressor._pixel_data, _ROWS_PER_TILE), repeat)
+    # The previous frame of an animation is the image moved down a row, so flat images have no changes at all and noisy ones change everywhere
+    previous_pixels = numpy.roll(pixels, 1, axis = 0).ravel()
+    delta, seconds["delta"] = _time(lambda: compressor._delta_convert(previous_pixels, compressor._pixel_data), repeat)
+    stream, seconds["stream"] = _time(lambda: b"".join(StreamEncoder.StreamEncoder(image_width).encode(pixels[row:row + _STREAM_ROWS] for row in range(0, image_height, _STREAM_ROWS))),
+                                      repeat)
+    stream_uncompressed = b"".join(StreamEncoder.StreamEncoder(image_width, compress = False).encode(pixels[row:row + _STREAM_ROWS] for row in range(0, image_height, _STREAM_ROWS)))
+    _, seconds["header"] = _time(lambda: compressor._emit_output(io.StringIO(), image_width, image_height, compressed, file_path, False, "0x0", True), repeat)
+    _, seconds["preview"] = _time(lambda: compressor._preview_ppm(compressor._pixel_data, image_width, image_height, 0x0), repeat)
+
+    # Every format has to decode back to exactly the pixels that were written to the file
+    errors = []
+    expected = pixels.ravel()
+    if not numpy.array_equal(numpy.asarray(compressor._pixel_data).ravel(), expected):
+        errors.append("open")
+    decoded = {
+        "uncompressed": compressor._uncompressed_decode(uncompressed, image_width, image_height),
+        "compressed": compressor._compressed_decode(compressed),
+        "extended": compressor._extended_decode(extended),
+        "row_indexed": compressor._compressed_decode(row_compressed),
+    }
+    errors.extend(data_format for data_format, pixels_out in decoded.items() if not numpy.array_equal(pixels_out, expected))
+    if not numpy.array_equal(compressor._delta_decode(delta, previous_pixels), expected):
+        errors.append("delta")
+    # The streaming encoder has to give exactly the same bytes as encoding the whole image at once
+    if stream != compressed.tobytes():
+        errors.append("stream")
+    if stream_uncompressed != uncompressed.tobytes():
+        errors.append("stream_uncompressed")
+
+    sizes = {
+        "pixels": int(expected.size),
+        "uncompressed": int(uncompressed.size),
+        "compressed": int(compressed.size),
+        "extended": int(extended.size),
+        "row_indexed": int(row_compressed.size + 2 * row_index.size),
+        "delta": int(delta.size),
+    }
+    return {"sizes": sizes, "ratio": sizes["uncompressed"] / min(sizes["uncompressed"], sizes["compressed"], sizes["extended"]), "seconds": seconds}, errors
+
+
+# Compares one image's results against the baseline, sizes must match exactly and times may only be slower by the tolerance (plus a millisecond so tiny stages don't fail from noise)
+def _compare(name, result, baseline, time_tolerance):
+    problems = []
+    notes = []
+    if baseline is None:
+        notes.append(f"{name}: not in the baseline")
+        return problems, notes
+    for data_format, size in result["sizes"].items():
+        baseline_size = baseline["sizes"].get(data_format)
+        if baseline_size is None:
+            continue
+        if size > baseline_size:
+            problems.append(f"{name}: {data_format} grew from {baseline_size} to {size} bytes")
+        elif size < baseline_size:
+            notes.append(f"{name}: {data_format} shrank from {baseline_size} to {size} bytes, update the baseline to keep it")
+    if time_tolerance:
+        for stage, seconds in result["seconds"].items():
+            baseline_seconds = baseline["seconds"].get(stage)
+            if baseline_seconds is not None and seconds > (baseline_seconds * time_tolerance) + 0.001:
+                problems.append(f"{name}: {stage} took {seconds * 1000:.2f} ms, the baseline is {baseline_seconds * 1000:.2f} ms")
+    return problems, notes
+
+
+def _parse_arguments(argv):
+    parser = argparse.ArgumentParser(description = "Time each stage of the conversion on synthetic images, check every format is lossless, and compare against a stored baseline")
+    parser.add_argument("-b", "--baseline", default = _BASELINE_PATH, help = "Baseline JSON file (defaults to benchmark_baseline.json next to this script)")
+    parser.add_argument("-u", "--update-baseline", action = "store_true", help = "Write the results as the new baseline instead of comparing against it")
+    parser.add_argument("-r", "--repeat", type = int, default = 3, help = "Number of times each stage is run, the fastest is kept (default 3)")
+    parser.add_argument("-n", "--runs", type = int, default = 1,
+                        help = "Number of times each image is benchmarked. Checks use the fastest run, and --update-baseline stores the slowest so one quick run doesn't set the baseline (default 1)")
+    parser.add_argument("-t", "--time-tolerance", type = float, default = 0,
+                        help = "Also fail if a stage is more than this many times slower than the baseline. Times depend on the machine and what else it is running, "
+                             "so the default of 0 only checks sizes and that every format is lossless")
+    parser.add_argument("-k", "--filter", default = "", help = "Only run images whose name contains this")
+    arguments = parser.parse_args(argv)
+    if arguments.repeat < 1 or arguments.runs < 1:
+        parser.error("--repeat and --runs must be at least 1")
+    return arguments
+
+
+def main(argv = None):
+    arguments = _parse_arguments(argv)
+    images = [image for image in _IMAGES if arguments.filter in image[0]]
+
+    baseline = {}
+    if not arguments.update_baseline:
+        try:
+            with open(arguments.baseline, "r") as baseline_file:
+                baseline = json.load(baseline_file)["images"]
+        except (OSError, ValueError, KeyError):
+            print(f"No usable baseline at {arguments.baseline}, run with --update-baseline to create one", file = sys.stderr)
+            return 1
+
+    results = {}
+    problems = []
+    notes = []
+    print(f"{'image':<24}{'uncompressed':>13}{'compressed':>11}{'extended':>9}{'row index':>10}{'ratio':>9}  " +
+          "  ".join(f"{stage:>9}" for stage in _STAGES) + "  (ms)")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, generator, image_width, image_height in images:
+            pixels = generator(image_width, image_height, seed = len(name))
+            errors = set()
+            result = None
+            for _ in range(arguments.runs):
+                run_result, run_errors = benchmark_image(name, pixels, directory, arguments.repeat)
+                errors.update(run_errors)
+                if result is None:
+                    result = run_result
+                else:  # The sizes are the same every run, only the times are combined
+                    keep = max if arguments.update_baseline else min
+                    result["seconds"] = {stage: keep(seconds, run_result["seconds"][stage]) for stage, seconds in result["seconds"].items()}
+            results[name] = result
+            problems.extend(f"{name}: {data_format} did not decode back to the original pixels" for data_format in sorted(errors))
+            sizes = result["sizes"]
+            print(f"{name:<24}{sizes['uncompressed']:>13}{sizes['compressed']:>11}{sizes['extended']:>9}{sizes['row_indexed']:>10}{result['ratio']:>9.2f}  " +
+                  "  ".join(f"{result['seconds'][stage] * 1000:>9.2f}" for stage in _STAGES))
+            if not arguments.update_baseline:
+                image_problems, image_notes = _compare(name, result, baseline.get(name), arguments.time_tolerance)
+                problems.extend(image_problems)
+                notes.extend(image_notes)
+
+    if arguments.update_baseline:
+        if problems:  # Never store a baseline from output that isn't lossless
+            print("\n".join(problems), file = sys.stderr)
+            return 1
+        with open(arguments.baseline, "w") as baseline_file:
+            json.dump({"images": results}, baseline_file, indent = 2)
+            baseline_file.write("\n")
+        print(f"Baseline written to {arguments.baseline}")
+        return 0
+
+    for note in notes:
+        print(note)
+    if problems:
+        print(f"\n{len(problems)} REGRESSIONS:", file = sys.stderr)
+        print("\n".join(problems), file = sys.stderr)
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())